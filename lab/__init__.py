@@ -0,0 +1,33 @@
+# Submodules are imported on first attribute access (lab.gyro_tools, ...), so
+# importing the package or one of its modules does not pull in lvgl, the
+# drivers and pyRTOS behind the others. Hardware is only set up by the get_*()
+# functions of the modules.
+
+_SUBMODULES = (
+    'bootprof',
+    'colors',
+    'deltat',
+    'device_tools',
+    'display_tools',
+    'dma2d',
+    'fusion',
+    'fusion_native',
+    'gyro_filters',
+    'gyro_tools',
+    'gyro_trace',
+    'host_disp',
+    'logger',
+    'pyrtos_tools',
+    'refresh',
+    'telemetry',
+    'touch',
+    'uasyncio_tools',
+    'vclock',
+    'demos',
+)
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return __import__('lab.' + name, None, None, (name,))
+    raise AttributeError(name)
@@ -0,0 +1,156 @@
+# Boot profiler: import time and heap per module from reset to the first frame.
+#
+# start() replaces builtins.__import__ with a wrapper that times every first
+# import of a module and the heap it allocated, mark() records milestones and
+# report() prints the result. On the board the ticks start at reset, so the
+# milestones are times since reset. run() does it all for a module with a
+# main(), e.g. from boot.py or main.py:
+#
+#   from lab import bootprof
+#   bootprof.run('lab.demos.lvgl_gyro')
+#
+# The report is printed once LVGL has drawn the first frame, or when main()
+# returns if it never does. Module times are inclusive (total) and without the
+# nested imports (self); heap numbers are inclusive and, unless collect is
+# set, include garbage created while importing.
+
+import builtins
+import gc
+import sys
+import time
+
+try:
+    from time import ticks_us, ticks_ms, ticks_diff
+except ImportError:
+    # CPython
+    def ticks_us():
+        return time.perf_counter_ns() // 1000
+
+    def ticks_ms():
+        return time.perf_counter_ns() // 1000000
+
+    def ticks_diff(end, start):
+        return end - start
+
+_import = builtins.__import__
+_records = []           # (module, depth, total μs, self μs, heap bytes) in import order
+_marks = []             # (label, ms since reset, heap bytes in use)
+_stack = []             # μs spent in nested imports of the imports in progress
+_active = []            # Modules of the imports in progress
+_collect = False
+
+
+def _mem():
+    if not hasattr(gc, 'mem_alloc'):
+        return 0
+    if _collect:
+        gc.collect()
+    return gc.mem_alloc()
+
+
+def _label(name, fromlist, level):
+    # Name of the module this import loads first, None if everything is loaded already
+    if level:
+        return None
+    if name not in sys.modules:
+        return name
+    for item in fromlist or ():
+        sub = name + '.' + item
+        # Module __dict__, as getattr() would run the lazy loading of lab/__init__.py
+        if sub not in sys.modules and item not in sys.modules[name].__dict__:
+            return sub
+    return None
+
+
+def _profiled_import(name, globals=None, locals=None, fromlist=(), level=0):
+    label = _label(name, fromlist, level)
+    if label is None or label in _active:
+        # Already loaded, or imported again from within its own import by the lazy loading in lab/__init__.py
+        return _import(name, globals, locals, fromlist, level)
+    index = len(_records)
+    _records.append(None)               # Keep the records in import order
+    _stack.append(0)
+    _active.append(label)
+    mem = _mem()
+    start = ticks_us()
+    try:
+        return _import(name, globals, locals, fromlist, level)
+    finally:
+        total = ticks_diff(ticks_us(), start)
+        nested = _stack.pop()
+        _active.pop()
+        if _stack:
+            _stack[-1] += total
+        if label in sys.modules:
+            _records[index] = (label, len(_stack), total, total - nested, _mem() - mem)
+
+
+def start(collect=False):
+    '''
+    Starts profiling imports. With collect the heap is garbage collected around every import, which
+    measures retained memory but slows the boot down.
+    '''
+    global _collect
+    _collect = collect
+    del _records[:]
+    del _marks[:]
+    builtins.__import__ = _profiled_import
+    mark('start')
+
+
+def stop():
+    builtins.__import__ = _import
+
+
+def mark(label):
+    _marks.append((label, ticks_ms(), _mem()))
+
+
+def report(file=None):
+    print('boot profile', file=file)
+    print('%-32s %9s %9s %9s' % ('module', 'total ms', 'self ms', 'heap'), file=file)
+    for record in _records:
+        if record is None:
+            # The import did not load the module after all (e.g. a from import of a non-module)
+            continue
+        module, depth, total, own, heap = record
+        print('%-32s %9.2f %9.2f %9d' % ('  ' * depth + module, total / 1000, own / 1000, heap), file=file)
+    print('%-32s %9s %9s' % ('milestone', 'ms', 'heap'), file=file)
+    for label, ms, heap in _marks:
+        print('%-32s %9d %9d' % (label, ms, heap), file=file)
+
+
+def _first_frame(timer):
+    # One-shot LVGL timer created before main() runs. It is called by the first lv.task_handler(),
+    # ahead of the display refresh, so the frame is drawn here to time it.
+    import lvgl as lv
+    timer._del()
+    lv.refr_now(None)
+    mark('first frame')
+    stop()
+    report()
+
+
+def run(module, entry='main', collect=False):
+    '''
+    Profiles importing module and running its entry function up to the first frame LVGL draws.
+    '''
+    start(collect)
+    mod = __import__(module, None, None, (entry,))
+    mark('imported')
+    reported = False
+    if 'lvgl' in sys.modules:
+        import lvgl as lv
+        lv.timer_create(_first_frame, 0, None)
+    else:
+        # Without LVGL there is no frame to wait for
+        stop()
+        report()
+        reported = True
+    try:
+        getattr(mod, entry)()
+    finally:
+        if not reported and builtins.__import__ is _profiled_import:
+            mark('exit')
+            stop()
+            report()
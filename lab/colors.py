@@ -1,151 +1,157 @@
-# https://gist.github.com/Kongduino/36d152c81bbb1214a2128a2712ecdd18
-TFT_ALICEBLUE = 0xF7DF
-TFT_ANTIQUEWHITE = 0xFF5A
-TFT_AQUA = 0x07FF
-TFT_AQUAMARINE = 0x7FFA
-TFT_AZURE = 0xF7FF
-TFT_BEIGE = 0xF7BB
-TFT_BISQUE = 0xFF38
-TFT_BLACK = 0x0000 #   0, 0, 0
-TFT_BLANCHEDALMOND = 0xFF59
-TFT_BLUE = 0x001F #   0, 0, 255
-TFT_BLUEVIOLET = 0x895C
-TFT_BROWN = 0xA145
-TFT_BURLYWOOD = 0xDDD0
-TFT_CADETBLUE = 0x5CF4
-TFT_CHARTREUSE = 0x7FE0
-TFT_CHOCOLATE = 0xD343
-TFT_CORAL = 0xFBEA
-TFT_CORNFLOWERBLUE = 0x64BD
-TFT_CORNSILK = 0xFFDB
-TFT_CRIMSON = 0xD8A7
-TFT_CYAN = 0x07FF #   0, 255, 255
-TFT_DARKBLUE = 0x0011
-TFT_DARKCYAN = 0x03EF #   0, 128, 128
-TFT_DARKCYAN2 = 0x0451
-TFT_DARKGOLDENROD = 0xBC21
-TFT_DARKGRAY = 0xAD55
-TFT_DARKGREEN2 = 0x0320
-TFT_DARKGREEN = 0x03E0 #   0, 128, 0
-TFT_DARKGREY = 0x7BEF # 128, 128, 128
-TFT_DARKKHAKI = 0xBDAD
-TFT_DARKMAGENTA = 0x8811
-TFT_DARKOLIVEGREEN = 0x5345
-TFT_DARKORANGE = 0xFC60
-TFT_DARKORCHID = 0x9999
-TFT_DARKRED = 0x8800
-TFT_DARKSALMON = 0xECAF
-TFT_DARKSEAGREEN = 0x8DF1
-TFT_DARKSLATEBLUE = 0x49F1
-TFT_DARKSLATEGRAY = 0x2A69
-TFT_DARKTURQUOISE = 0x067A
-TFT_DARKVIOLET = 0x901A
-TFT_DEEPPINK = 0xF8B2
-TFT_DEEPSKYBLUE = 0x05FF
-TFT_DIMGRAY = 0x6B4D
-TFT_DODGERBLUE = 0x1C9F
-TFT_FIREBRICK = 0xB104
-TFT_FLORALWHITE = 0xFFDE
-TFT_FORESTGREEN = 0x2444
-TFT_FUCHSIA = 0xF81F
-TFT_GAINSBORO = 0xDEFB
-TFT_GHOSTWHITE = 0xFFDF
-TFT_GOLD = 0xFEA0
-TFT_GOLDENROD = 0xDD24
-TFT_GRAY = 0x8410
-TFT_GREEN2 = 0x0400
-TFT_GREEN = 0x07E0 #   0, 255, 0
-TFT_GREENYELLOW = 0xAFE5 # 173, 255, 47
-TFT_HONEYDEW = 0xF7FE
-TFT_HOTPINK = 0xFB56
-TFT_INDIANRED = 0xCAEB
-TFT_INDIGO = 0x4810
-TFT_IVORY = 0xFFFE
-TFT_KHAKI = 0xF731
-TFT_LAVENDER = 0xE73F
-TFT_LAVENDERBLUSH = 0xFF9E
-TFT_LAWNGREEN = 0x7FE0
-TFT_LEMONCHIFFON = 0xFFD9
-TFT_LIGHTBLUE = 0xAEDC
-TFT_LIGHTCORAL = 0xF410
-TFT_LIGHTCYAN = 0xE7FF
-TFT_LIGHTGOLDENRODYELLOW = 0xFFDA
-TFT_LIGHTGREEN = 0x9772
-TFT_LIGHTGREY = 0xC618 # 192, 192, 192
-TFT_LIGHTGREY2 = 0xD69A
-TFT_LIGHTPINK = 0xFDB8
-TFT_LIGHTSALMON = 0xFD0F
-TFT_LIGHTSEAGREEN = 0x2595
-TFT_LIGHTSKYBLUE = 0x867F
-TFT_LIGHTSLATEGRAY = 0x7453
-TFT_LIGHTSTEELBLUE = 0xB63B
-TFT_LIGHTYELLOW = 0xFFFC
-TFT_LIME = 0x07E0
-TFT_LIMEGREEN = 0x3666
-TFT_LINEN = 0xFF9C
-TFT_MAGENTA = 0xF81F # 255, 0, 255
-TFT_MAROON = 0x7800 # 128, 0, 0
-TFT_MAROON2 = 0x8000
-TFT_MEDIUMAQUAMARINE = 0x6675
-TFT_MEDIUMBLUE = 0x0019
-TFT_MEDIUMORCHID = 0xBABA
-TFT_MEDIUMPURPLE = 0x939B
-TFT_MEDIUMSEAGREEN = 0x3D8E
-TFT_MEDIUMSLATEBLUE = 0x7B5D
-TFT_MEDIUMSPRINGGREEN = 0x07D3
-TFT_MEDIUMTURQUOISE = 0x4E99
-TFT_MEDIUMVIOLETRED = 0xC0B0
-TFT_MIDNIGHTBLUE = 0x18CE
-TFT_MINTCREAM = 0xF7FF
-TFT_MISTYROSE = 0xFF3C
-TFT_MOCCASIN = 0xFF36
-TFT_NAVAJOWHITE = 0xFEF5
-TFT_NAVY = 0x000F #   0, 0, 128
-TFT_NAVY2 = 0x0010
-TFT_OLDLACE = 0xFFBC
-TFT_OLIVE = 0x7BE0 # 128, 128, 0
-TFT_OLIVE2 = 0x8400
-TFT_OLIVEDRAB = 0x6C64
-TFT_ORANGE = 0xFD20 # 255, 165, 0
-TFT_ORANGERED = 0xFA20
-TFT_ORCHID = 0xDB9A
-TFT_PALEGOLDENROD = 0xEF55
-TFT_PALEGREEN = 0x9FD3
-TFT_PALETURQUOISE = 0xAF7D
-TFT_PALEVIOLETRED = 0xDB92
-TFT_PAPAYAWHIP = 0xFF7A
-TFT_PEACHPUFF = 0xFED7
-TFT_PERU = 0xCC27
-TFT_PINK = 0xF81F
-TFT_PINK_2 = 0xFE19
-TFT_PLUM = 0xDD1B
-TFT_POWDERBLUE = 0xB71C
-TFT_PURPLE = 0x780F # 128, 0, 128
-TFT_PURPLE2 = 0x8010
-TFT_RED = 0xF800 # 255, 0, 0
-TFT_ROSYBROWN = 0xBC71
-TFT_ROYALBLUE = 0x435C
-TFT_SADDLEBROWN = 0x8A22
-TFT_SALMON = 0xFC0E
-TFT_SANDYBROWN = 0xF52C
-TFT_SEAGREEN = 0x2C4A
-TFT_SEASHELL = 0xFFBD
-TFT_SIENNA = 0xA285
-TFT_SILVER = 0xC618
-TFT_SKYBLUE = 0x867D
-TFT_SLATEBLUE = 0x6AD9
-TFT_SLATEGRAY = 0x7412
-TFT_SNOW = 0xFFDF
-TFT_SPRINGGREEN = 0x07EF
-TFT_STEELBLUE = 0x4416
-TFT_TAN = 0xD5B1
-TFT_TEAL = 0x0410
-TFT_THISTLE = 0xDDFB
-TFT_TOMATO = 0xFB08
-TFT_TURQUOISE = 0x471A
-TFT_VIOLET = 0xEC1D
-TFT_WHEAT = 0xF6F6
-TFT_WHITE = 0xFFFF # 255, 255, 255
-TFT_WHITESMOKE = 0xF7BE
-TFT_YELLOW = 0xFFE0 # 255, 255, 0
-TFT_YELLOWGREEN = 0x9E66
\ No newline at end of file
+# RGB565 colour palette and conversion helpers.
+#
+# Colour values from https://gist.github.com/Kongduino/36d152c81bbb1214a2128a2712ecdd18
+#
+# The palette is stored as a sorted name tuple plus a packed table of RGB565
+# values instead of ~150 module globals, so frozen into the firmware it lives
+# in flash. The old names still work (colors.TFT_RED, via module __getattr__),
+# faster are rgb565('RED') or index() once and value() in hot code:
+#
+#   from lab import colors
+#   style.set_bg_color(colors.lv_color('DARKSLATEBLUE'))     # cached lv.color_t
+#   colors.rgb888(colors.TFT_TOMATO)                         # 0xff6142
+
+import struct
+
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+
+_COUNT = const(150)
+
+_NAMES = (
+    'ALICEBLUE', 'ANTIQUEWHITE', 'AQUA', 'AQUAMARINE', 'AZURE', 'BEIGE', 'BISQUE', 'BLACK',
+    'BLANCHEDALMOND', 'BLUE', 'BLUEVIOLET', 'BROWN', 'BURLYWOOD', 'CADETBLUE', 'CHARTREUSE',
+    'CHOCOLATE', 'CORAL', 'CORNFLOWERBLUE', 'CORNSILK', 'CRIMSON', 'CYAN', 'DARKBLUE', 'DARKCYAN',
+    'DARKCYAN2', 'DARKGOLDENROD', 'DARKGRAY', 'DARKGREEN', 'DARKGREEN2', 'DARKGREY', 'DARKKHAKI',
+    'DARKMAGENTA', 'DARKOLIVEGREEN', 'DARKORANGE', 'DARKORCHID', 'DARKRED', 'DARKSALMON',
+    'DARKSEAGREEN', 'DARKSLATEBLUE', 'DARKSLATEGRAY', 'DARKTURQUOISE', 'DARKVIOLET', 'DEEPPINK',
+    'DEEPSKYBLUE', 'DIMGRAY', 'DODGERBLUE', 'FIREBRICK', 'FLORALWHITE', 'FORESTGREEN', 'FUCHSIA',
+    'GAINSBORO', 'GHOSTWHITE', 'GOLD', 'GOLDENROD', 'GRAY', 'GREEN', 'GREEN2', 'GREENYELLOW',
+    'HONEYDEW', 'HOTPINK', 'INDIANRED', 'INDIGO', 'IVORY', 'KHAKI', 'LAVENDER', 'LAVENDERBLUSH',
+    'LAWNGREEN', 'LEMONCHIFFON', 'LIGHTBLUE', 'LIGHTCORAL', 'LIGHTCYAN', 'LIGHTGOLDENRODYELLOW',
+    'LIGHTGREEN', 'LIGHTGREY', 'LIGHTGREY2', 'LIGHTPINK', 'LIGHTSALMON', 'LIGHTSEAGREEN',
+    'LIGHTSKYBLUE', 'LIGHTSLATEGRAY', 'LIGHTSTEELBLUE', 'LIGHTYELLOW', 'LIME', 'LIMEGREEN',
+    'LINEN', 'MAGENTA', 'MAROON', 'MAROON2', 'MEDIUMAQUAMARINE', 'MEDIUMBLUE', 'MEDIUMORCHID',
+    'MEDIUMPURPLE', 'MEDIUMSEAGREEN', 'MEDIUMSLATEBLUE', 'MEDIUMSPRINGGREEN', 'MEDIUMTURQUOISE',
+    'MEDIUMVIOLETRED', 'MIDNIGHTBLUE', 'MINTCREAM', 'MISTYROSE', 'MOCCASIN', 'NAVAJOWHITE', 'NAVY',
+    'NAVY2', 'OLDLACE', 'OLIVE', 'OLIVE2', 'OLIVEDRAB', 'ORANGE', 'ORANGERED', 'ORCHID',
+    'PALEGOLDENROD', 'PALEGREEN', 'PALETURQUOISE', 'PALEVIOLETRED', 'PAPAYAWHIP', 'PEACHPUFF',
+    'PERU', 'PINK', 'PINK_2', 'PLUM', 'POWDERBLUE', 'PURPLE', 'PURPLE2', 'RED', 'ROSYBROWN',
+    'ROYALBLUE', 'SADDLEBROWN', 'SALMON', 'SANDYBROWN', 'SEAGREEN', 'SEASHELL', 'SIENNA', 'SILVER',
+    'SKYBLUE', 'SLATEBLUE', 'SLATEGRAY', 'SNOW', 'SPRINGGREEN', 'STEELBLUE', 'TAN', 'TEAL',
+    'THISTLE', 'TOMATO', 'TURQUOISE', 'VIOLET', 'WHEAT', 'WHITE', 'WHITESMOKE', 'YELLOW',
+    'YELLOWGREEN',
+)
+
+_VALUES = (
+    b'\xdf\xf7\x5a\xff\xff\x07\xfa\x7f\xff\xf7\xbb\xf7\x38\xff\x00\x00\x59\xff\x1f\x00\x5c\x89\x45'
+    b'\xa1\xd0\xdd\xf4\x5c\xe0\x7f\x43\xd3\xea\xfb\xbd\x64\xdb\xff\xa7\xd8\xff\x07\x11\x00\xef\x03'
+    b'\x51\x04\x21\xbc\x55\xad\xe0\x03\x20\x03\xef\x7b\xad\xbd\x11\x88\x45\x53\x60\xfc\x99\x99\x00'
+    b'\x88\xaf\xec\xf1\x8d\xf1\x49\x69\x2a\x7a\x06\x1a\x90\xb2\xf8\xff\x05\x4d\x6b\x9f\x1c\x04\xb1'
+    b'\xde\xff\x44\x24\x1f\xf8\xfb\xde\xdf\xff\xa0\xfe\x24\xdd\x10\x84\xe0\x07\x00\x04\xe5\xaf\xfe'
+    b'\xf7\x56\xfb\xeb\xca\x10\x48\xfe\xff\x31\xf7\x3f\xe7\x9e\xff\xe0\x7f\xd9\xff\xdc\xae\x10\xf4'
+    b'\xff\xe7\xda\xff\x72\x97\x18\xc6\x9a\xd6\xb8\xfd\x0f\xfd\x95\x25\x7f\x86\x53\x74\x3b\xb6\xfc'
+    b'\xff\xe0\x07\x66\x36\x9c\xff\x1f\xf8\x00\x78\x00\x80\x75\x66\x19\x00\xba\xba\x9b\x93\x8e\x3d'
+    b'\x5d\x7b\xd3\x07\x99\x4e\xb0\xc0\xce\x18\xff\xf7\x3c\xff\x36\xff\xf5\xfe\x0f\x00\x10\x00\xbc'
+    b'\xff\xe0\x7b\x00\x84\x64\x6c\x20\xfd\x20\xfa\x9a\xdb\x55\xef\xd3\x9f\x7d\xaf\x92\xdb\x7a\xff'
+    b'\xd7\xfe\x27\xcc\x1f\xf8\x19\xfe\x1b\xdd\x1c\xb7\x0f\x78\x10\x80\x00\xf8\x71\xbc\x5c\x43\x22'
+    b'\x8a\x0e\xfc\x2c\xf5\x4a\x2c\xbd\xff\x85\xa2\x18\xc6\x7d\x86\xd9\x6a\x12\x74\xdf\xff\xef\x07'
+    b'\x16\x44\xb1\xd5\x10\x04\xfb\xdd\x08\xfb\x1a\x47\x1d\xec\xf6\xf6\xff\xff\xbe\xf7\xe0\xff\x66'
+    b'\x9e'
+)
+
+_EXPAND5 = (
+    b'\x00\x08\x10\x19\x21\x29\x31\x3a\x42\x4a\x52\x5a\x63\x6b\x73\x7b\x84\x8c\x94\x9c\xa5\xad\xb5'
+    b'\xbd\xc5\xce\xd6\xde\xe6\xef\xf7\xff'
+)
+_EXPAND6 = (
+    b'\x00\x04\x08\x0c\x10\x14\x18\x1c\x20\x24\x28\x2d\x31\x35\x39\x3d\x41\x45\x49\x4d\x51\x55\x59'
+    b'\x5d\x61\x65\x69\x6d\x71\x75\x79\x7d\x82\x86\x8a\x8e\x92\x96\x9a\x9e\xa2\xa6\xaa\xae\xb2\xb6'
+    b'\xba\xbe\xc2\xc6\xca\xce\xd2\xd7\xdb\xdf\xe3\xe7\xeb\xef\xf3\xf7\xfb\xff'
+)
+
+_lv_colors = {}
+
+
+def index(name):
+    '''
+    Returns the palette index of the colour name (without the TFT_ prefix, upper case).
+    Raises KeyError for unknown names.
+    '''
+    lo = 0
+    hi = _COUNT
+    while lo < hi:
+        mid = (lo + hi) >> 1
+        if _NAMES[mid] < name:
+            lo = mid + 1
+        else:
+            hi = mid
+    if lo == _COUNT or _NAMES[lo] != name:
+        raise KeyError(name)
+    return lo
+
+
+def value(i):
+    # RGB565 value of the palette index i
+    return struct.unpack_from('<H', _VALUES, 2 * i)[0]
+
+
+def rgb565(name):
+    return value(index(name))
+
+
+def names():
+    return _NAMES
+
+
+def __getattr__(name):
+    # Backwards compatible TFT_<NAME> constants
+    if name.startswith('TFT_'):
+        try:
+            return rgb565(name[4:])
+        except KeyError:
+            pass
+    raise AttributeError(name)
+
+
+def rgb888(c):
+    '''
+    Converts RGB565 to 0xRRGGBB, expanding the channels to the full 0..255 range.
+    '''
+    return (_EXPAND5[c >> 11] << 16) | (_EXPAND6[(c >> 5) & 0x3F] << 8) | _EXPAND5[c & 0x1F]
+
+
+def rgb565_from888(c):
+    # Converts 0xRRGGBB to RGB565 (truncating)
+    return ((c >> 8) & 0xF800) | ((c >> 5) & 0x07E0) | ((c >> 3) & 0x001F)
+
+
+def swap16(c):
+    # Byte swapped RGB565, as expected by big endian SPI displays and LV_COLOR_16_SWAP
+    return ((c & 0xFF) << 8) | (c >> 8)
+
+
+def swap_buffer(buf, count=None):
+    '''
+    Byte swaps the first count (default all) RGB565 pixels of the bytearray or memoryview buf in place.
+    '''
+    if count is None:
+        count = len(buf) >> 1
+    for i in range(0, 2 * count, 2):
+        buf[i], buf[i + 1] = buf[i + 1], buf[i]
+
+
+def lv_color(c):
+    '''
+    Returns an lv.color_t for a palette name or an RGB565 value. The objects are cached, so styling code
+    can call this repeatedly without converting and allocating again. Do not modify the returned object.
+    '''
+    color = _lv_colors.get(c)
+    if color is None:
+        import lvgl as lv
+        color = lv.color_hex(rgb888(rgb565(c) if isinstance(c, str) else c))
+        _lv_colors[c] = color
+    return color
@@ -38,6 +38,20 @@
 # On 1st pass dt evidently can't be computed. A notional value of 100μs is
 # returned. The Madgwick algorithm takes seconds to stabilise.
 
+# All classes have a scale attribute giving the returned unit in seconds, so
+# the fusion code can fold the unit conversion into its own constants:
+# DeltaT returns float seconds (scale 1).
+# DeltaTUs returns integer microseconds (scale 1e-6) straight from
+# time.ticks_diff(), avoiding the function call and float division per sample.
+# FixedDeltaT returns a constant period in integer microseconds for samples
+# clocked by hardware (e.g. the gyro FIFO) and records the jitter of the
+# intervals at which it is actually called. A fractional period (1e6 / 760 Hz
+# is 1315.79μs) is rounded and the remainder folded into its scale.
+
+# Instead of the time module all classes can use a clock object providing
+# ticks_us() and ticks_diff(), e.g. lab.vclock.VirtualClock for simulations on
+# a host. Such a clock counts as MicroPython time source.
+
 try:
     import utime as time
 except ImportError:
@@ -45,12 +59,20 @@ except ImportError:
 
 is_micropython = hasattr(time, 'ticks_diff')
 
+# timediff function for ticks_us() timestamps captured elsewhere, e.g. in an interrupt handler
+def ticks_timediff(end, start):
+    return time.ticks_diff(end, start) / 1000000
+
 class DeltaT():
-    def __init__(self, timediff):
+    scale = 1
+    def __init__(self, timediff, clock=None):
+        self.clock = time if clock is None and is_micropython else clock
         if timediff is None:
             self.expect_ts = False
-            if is_micropython:
-                self.timediff = lambda start, end : time.ticks_diff(start, end)/1000000
+            if clock is not None:
+                self.timediff = lambda end, start: clock.ticks_diff(end, start) / 1000000
+            elif is_micropython:
+                self.timediff = ticks_timediff
             else:
                 raise ValueError('You must define a timediff function')
         else:
@@ -63,8 +85,8 @@ class DeltaT():
             if ts is None:
                 raise ValueError('Timestamp expected but not supplied.')
         else:
-            if is_micropython:
-                ts = time.ticks_us()
+            if self.clock is not None:
+                ts = self.clock.ticks_us()
             else:
                 raise RuntimeError('Not MicroPython: provide timestamps and a timediff function')
         # ts is now valid
@@ -75,3 +97,69 @@ class DeltaT():
         dt = self.timediff(ts, self.start_time)
         self.start_time = ts
         return dt
+
+
+class DeltaTUs():
+    scale = 0.000001
+    def __init__(self, expect_ts=False, clock=None):
+        if clock is None:
+            if not is_micropython:
+                raise ValueError('DeltaTUs needs MicroPython ticks or a clock')
+            clock = time
+        self.clock = clock
+        self.expect_ts = expect_ts
+        self.start_time = None
+
+    def __call__(self, ts=None):
+        if ts is None:
+            if self.expect_ts:
+                raise ValueError('Timestamp expected but not supplied.')
+            ts = self.clock.ticks_us()
+        start = self.start_time
+        self.start_time = ts
+        if start is None:
+            return 100  # 100μs notional delay as in DeltaT
+        return self.clock.ticks_diff(ts, start)
+
+
+class FixedDeltaT():
+    scale = 0.000001
+    def __init__(self, period_us, expect_ts=False, clock=None):
+        self.period = round(period_us)
+        # Instance scale, so that period * scale is the exact period in seconds
+        self.scale = period_us * 0.000001 / self.period
+        self.clock = time if clock is None and is_micropython else clock
+        # With expect_ts the caller passes timestamps (e.g. FIFO read times) for the jitter statistics,
+        # otherwise they are taken from ticks_us() on MicroPython (or the clock) and not recorded elsewhere.
+        self.expect_ts = expect_ts
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.start_time = None
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def __call__(self, ts=None):
+        if ts is None and not self.expect_ts and self.clock is not None:
+            ts = self.clock.ticks_us()
+        if ts is not None:
+            start = self.start_time
+            self.start_time = ts
+            if start is not None:
+                interval = self.clock.ticks_diff(ts, start) if self.clock is not None else ts - start
+                self.count += 1
+                self.total += interval
+                if self.min is None or interval < self.min:
+                    self.min = interval
+                if self.max is None or interval > self.max:
+                    self.max = interval
+        return self.period
+
+    def stats(self):
+        '''
+        Returns min, max and mean call interval in μs and the number of intervals measured.
+        '''
+        mean = self.total / self.count if self.count else None
+        return self.min, self.max, mean, self.count
@@ -0,0 +1,31 @@
+# Demos are imported on first attribute access, see lab/__init__.py.
+# run() starts one, optionally under the boot profiler (lab.bootprof).
+
+_DEMOS = (
+    'lvgl_gyro',
+    'lvgl_hello_world',
+    'pyrtos_hello_world',
+    'pyrtos_sample',
+    'uasyncio_hello_world',
+    'uasyncio_sample',
+)
+
+
+def __getattr__(name):
+    if name in _DEMOS:
+        return __import__('lab.demos.' + name, None, None, (name,))
+    raise AttributeError(name)
+
+
+def run(name, profile=False):
+    '''
+    Runs the main() of the demo name. With profile the imports up to the first frame are timed and
+    reported, see lab.bootprof.run().
+    '''
+    if name not in _DEMOS:
+        raise ValueError('Unknown demo ' + name)
+    if profile:
+        from lab import bootprof
+        bootprof.run('lab.demos.' + name)
+    else:
+        __getattr__(name).main()
@@ -1,11 +1,43 @@
+import time
+from array import array
+
 import lvgl as lv
 
 from lab import gyro_tools
+from lab.deltat import FixedDeltaT
 from lab import display_tools
 
+
+DISPLAY_FREQ = 25
+FIFO_BLOCK = 16             # Samples collected in the sensor FIFO between two reads (the FIFO holds 32)
+
+
+# Helper class, called periodically by an LVGL timer to show the latest orientation
+class OrientationView():
+    def __init__(self, gm, bar_pitch, bar_roll):
+        self.gm = gm
+        self.bar_pitch = bar_pitch
+        self.bar_roll = bar_roll
+        self.pitch = 0
+        self.roll = 0
+
+    def update_cb(self, tim):
+        # Only invalidate the widgets whose displayed value actually changed
+        pitch = int(self.gm.pitch)
+        if pitch != self.pitch:
+            self.pitch = pitch
+            self.bar_pitch.set_value(pitch, lv.ANIM.OFF)
+        roll = int(self.gm.roll)
+        if roll != self.roll:
+            self.roll = roll
+            self.bar_roll.set_value(roll, lv.ANIM.OFF)
+
+
 def main():
     gyro = gyro_tools.get_gyro()
-    gm = gyro_tools.GyroMadgwick()
+    gyro.enable_fifo()
+    # FIFO samples are clocked by the sensor, so integrate them with its period
+    gm = gyro_tools.GyroMadgwick(deltat=FixedDeltaT(1000000 / gyro.odr, True))
 
     d = display_tools.get_display()
     w, h = d.width(), d.height()
@@ -43,9 +75,21 @@ def main():
     bar2.set_grid_cell(lv.GRID_ALIGN.CENTER, 1, 1,
                        lv.GRID_ALIGN.CENTER, 0, 1)
 
-    for pitch, roll in gm.run(gyro):
-        bar1.set_value(int(pitch), lv.ANIM.OFF)
-        bar2.set_value(int(roll), lv.ANIM.OFF)
+    # UI stage: picks up the latest orientation at DISPLAY_FREQ from the LVGL event loop
+    view = OrientationView(gm, bar1, bar2)
+    timer = lv.timer_create_basic()
+    timer.set_period(1000 // DISPLAY_FREQ)
+    timer.set_cb(view.update_cb)
+
+    # Sensor stage: drains the FIFO every FIFO_BLOCK samples and integrates each sample once,
+    # sleeping in between so the event loop gets the CPU. The Euler angles are only computed
+    # when the UI stage reads them
+    buf = array('h', bytes(6 * 32))
+    block_ms = FIFO_BLOCK * 1000 // gyro.odr
+    while True:
+        count, ts = gyro.read_block(buf)
+        gm.update_block(buf, count, gyro.mdps_per_lsb, ts=ts)
+        time.sleep_ms(block_ms)
 
 
 if __name__ == '__main__':
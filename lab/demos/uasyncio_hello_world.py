@@ -0,0 +1,22 @@
+import lvgl as lv
+
+from lab import display_tools
+from lab import uasyncio_tools
+from lab.demos.lvgl_hello_world import lv_hello_world, lv_anim_arc
+
+def main():
+    # Init display driver
+    d = display_tools.get_display()
+
+    # Init demo
+    if not lv.is_initialized():
+        lv.init()
+    lv_hello_world()
+    lv_anim_arc()
+
+    # Hand control over to uasyncio. This is a blocking call, there can't be other statements after that.
+    uasyncio_tools.run(uasyncio_tools.display_refresh())
+
+
+if __name__ == '__main__':
+    main()
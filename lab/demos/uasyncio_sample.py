@@ -0,0 +1,76 @@
+# uasyncio version of pyrtos_sample.py, using the message passing helpers from lab.uasyncio_tools
+
+from lab import uasyncio_tools as rt
+from lab.uasyncio_tools import asyncio
+
+
+# User defined message types start at 128
+REQUEST_DATA = 128
+SENT_DATA = 129
+
+
+async def sample_task(name):
+
+    ### Setup code here
+    box = rt.mailbox(name)
+
+    ### End Setup code
+
+    # Pass control back to the scheduler
+    await asyncio.sleep_ms(0)
+
+    # Task loop
+    while True:
+
+        # Check messages
+        while len(box):
+            msg = await box.get()
+
+            ### Handle messages by adding elifs to this
+            if msg.type == rt.QUIT:  # This allows you to
+                                     # terminate a task.
+                                     # This condition may be removed if
+                                     # the task should never terminate.
+
+                ### Tear down code here
+                print("Terminating task:", name)
+                print("Terminated by:", msg.source)
+
+                ### End of Tear down code
+                return
+            elif msg.type == REQUEST_DATA: # Example message, using user
+                                           # message types
+                rt.send(rt.Message(SENT_DATA, name, msg.source, "This is data"))
+            ### End Message Handler
+
+        ### Work code here
+        # Unlike pyRTOS tasks, coroutines only give up the CPU at await.
+        # Await periodically if there is significant code here.
+
+        ### End Work code
+
+        await asyncio.sleep(0.5)
+
+        if name == "task1":
+            target = "task2"
+        else:
+            target = "task1"
+
+        print(name, "sending quit message to:", target)
+        rt.send(rt.Message(rt.QUIT, name, target))
+
+        # Testing message passing system
+        print(name, "sending quit message to:", "task3 (does not exist)")
+        print("This should silently fail")
+        rt.send(rt.Message(rt.QUIT, name, "task3"))
+
+        # Wait for a message
+        await box.wait()
+
+
+def main():
+    rt.run(sample_task("task1"), sample_task("task2"))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,46 +1,205 @@
 # Based on the work by Thomas Hornschuh (https://github.com/ThomasHornschuh)
 
+import time
+from array import array
+
 import lvgl as lv
 
-import stm32f429disc_disp
+try:
+    import stm32f429disc_disp
+except ImportError:
+    # Not on the board: render into an in-memory framebuffer instead
+    from lab import host_disp as stm32f429disc_disp
 
 from lab.device_tools import _getinstance
+from lab.touch import IDENTITY as _TOUCH_IDENTITY, TouchPipeline, fit_affine, median, save_calibration
 
 
-def get_display(calibration_values=[-3, 16, 247, 337]):
-    return _getinstance(Display, calibration_values=calibration_values)
+# Draw buffer strategies for Display
+BUF_PARTIAL = const(0)      # buffer_lines high strips, copied to the screen by the driver
+BUF_FULL = const(1)         # Screen sized buffers, the whole screen is redrawn on every refresh
+BUF_DIRECT = const(2)       # Screen sized buffers, only the changed areas are redrawn and copied
 
+# How rendered areas get to the LTDC frame buffer (BUF_PARTIAL and BUF_FULL only)
+FLUSH_SYNC = const(0)       # The driver copies the area before flush_cb returns
+FLUSH_DMA2D = const(1)      # DMA2D copies the area while LVGL renders into the other buffer
+
+# Current frame buffer address register of LTDC layer 1
+_LTDC_L1CFBAR = const(0x400168AC)
+
+
+# Touch calibration used when none has been stored, see lab.touch
+DEFAULT_CALIBRATION = (-3, 16, 247, 337)
+
+# Driver calibration under an affine one: DEFAULT_CALIBRATION widened by a quarter of its span on each
+# side, so the driver does not clamp touches near the edges before the affine map, which is fitted to
+# these coordinates, sees them
+_x1, _y1, _x2, _y2 = DEFAULT_CALIBRATION
+PASS_THROUGH_CALIBRATION = ((5 * _x1 - _x2) // 4, (5 * _y1 - _y2) // 4, (5 * _x2 - _x1) // 4, (5 * _y2 - _y1) // 4)
+del _x1, _y1, _x2, _y2
+
+
+def get_display(calibration_values=None, **kwargs):
+    # Without calibration_values the one stored by calibrate_touchscreen() is used, if there is one.
+    # A stored affine calibration needs the touch pipeline, without it the default is used
+    if calibration_values is None:
+        from lab.touch import load_calibration
+        calibration_values = load_calibration()
+        if calibration_values is None or (len(calibration_values) == 6 and not kwargs.get('touch_filter', True)):
+            calibration_values = DEFAULT_CALIBRATION
+    return _getinstance(Display, calibration_values=calibration_values, **kwargs)
 
-class Display:
 
-    def __init__(self, calibration_values=None):
+class Display:
+    '''
+    buffer_mode selects the draw buffer strategy (BUF_PARTIAL, BUF_FULL or BUF_DIRECT), double_buffer
+    allocates a second buffer LVGL can render into while the first one is flushed.
+    flush_mode FLUSH_DMA2D starts the copy to the frame buffer with DMA2D and returns at once, the transfer
+    is reported complete to LVGL from wait_cb; FLUSH_SYNC uses the driver's blocking flush.
+    With instrument=True flush and render statistics are collected, see stats().
+    touch_filter puts a lab.touch.TouchPipeline between the touch driver and LVGL, which samples the
+    touch every touch_sample_ms from a machine.Timer (None: only when LVGL reads it), so its median,
+    smoothing and debounce windows span a few milliseconds instead of several LVGL reads. touch_read_ms changes how often LVGL
+    reads the touch input (default LV_INDEV_DEF_READ_PERIOD).
+    calibration_values are either the driver's two point calibration (x1, y1, x2, y2) or the six
+    affine coefficients of lab.touch.fit_affine(), which need the touch pipeline.
+    '''
+
+    def __init__(self, calibration_values=None, buffer_mode=BUF_PARTIAL, buffer_lines=30, double_buffer=True,
+                 flush_mode=FLUSH_SYNC, instrument=False, touch_filter=True, touch_read_ms=None,
+                 touch_sample_ms=5):
         lv.init()
         stm32f429disc_disp.init()
         self.w = stm32f429disc_disp.lcd_width()
         self.h = stm32f429disc_disp.lcd_height()
+        self.buffer_mode = buffer_mode
 
-        draw_buf = lv.disp_draw_buf_t()
-        bufsz =  self.w * 30 * lv.color_t.__SIZE__
-        buf1_1 = bytearray(bufsz)
-        buf1_2 = bytearray(bufsz)
+        lines = buffer_lines if buffer_mode == BUF_PARTIAL else self.h
+        bufsz = self.w * lines * lv.color_t.__SIZE__
+        # Keep references to the buffers, LVGL only holds their addresses
+        self.buf1 = bytearray(bufsz)
+        self.buf2 = bytearray(bufsz) if double_buffer else None
 
-        draw_buf.init(buf1_1, buf1_2, len(buf1_1) // lv.color_t.__SIZE__)
+        self.draw_buf = lv.disp_draw_buf_t()
+        self.draw_buf.init(self.buf1, self.buf2, bufsz // lv.color_t.__SIZE__)
         disp_drv = lv.disp_drv_t()
         disp_drv.init()
-        disp_drv.draw_buf = draw_buf
-        disp_drv.flush_cb = stm32f429disc_disp.flush
+        disp_drv.draw_buf = self.draw_buf
+        if buffer_mode == BUF_DIRECT:
+            disp_drv.direct_mode = 1
+            self.fb = self._framebuffer()
+            self._flush = self._flush_direct
+        else:
+            disp_drv.full_refresh = 1 if buffer_mode == BUF_FULL else 0
+            if flush_mode == FLUSH_DMA2D:
+                from lab.dma2d import DMA2D
+                self.dma2d = DMA2D()
+                self.fb_address = self._framebuffer_address()
+                self._flush = self._flush_dma2d
+                disp_drv.wait_cb = self._wait_dma2d
+            else:
+                self._flush = stm32f429disc_disp.flush
+        self.reset_stats()
+        if instrument:
+            disp_drv.flush_cb = self._flush_instrumented
+            disp_drv.monitor_cb = self._monitor
+        else:
+            disp_drv.flush_cb = self._flush
         disp_drv.hor_res = self.w
         disp_drv.ver_res = self.h
         disp_drv.register()
+        self.disp_drv = disp_drv
 
         indev_drv = lv.indev_drv_t()
         indev_drv.init()
         indev_drv.type = lv.INDEV_TYPE.POINTER
-        indev_drv.read_cb = stm32f429disc_disp.ts_read
+        if touch_filter:
+            self.touch = TouchPipeline(stm32f429disc_disp.ts_read, self.w, self.h, indev_drv=indev_drv)
+            indev_drv.read_cb = self.touch.read_cb
+        else:
+            self.touch = None
+            indev_drv.read_cb = stm32f429disc_disp.ts_read
         indev_drv.register()
+        if touch_read_ms is not None:
+            indev_drv.read_timer.set_period(touch_read_ms)
+        if self.touch is not None and touch_sample_ms is not None:
+            self.touch.start_sampling(touch_sample_ms)
+        self.indev_drv = indev_drv
 
         if calibration_values is not None:
-            self.set_touchscreen_calibration_values(*calibration_values)
+            self.set_touch_calibration(calibration_values)
+
+    def _framebuffer_address(self):
+        import machine
+        return machine.mem32[_LTDC_L1CFBAR] & 0xFFFFFFFF
+
+    def _framebuffer(self):
+        if hasattr(stm32f429disc_disp, 'framebuffer'):
+            return stm32f429disc_disp.framebuffer()
+        import uctypes
+        return uctypes.bytearray_at(self._framebuffer_address(), self.w * self.h * lv.color_t.__SIZE__)
+
+    def _flush_dma2d(self, disp_drv, area, color_p):
+        # Only starts the transfer, flush_ready() is called from _wait_dma2d() once it has completed
+        import uctypes
+        size = lv.color_t.__SIZE__
+        w = area.x2 - area.x1 + 1
+        h = area.y2 - area.y1 + 1
+        src = uctypes.addressof(color_p.__dereference__(w * h * size))
+        dst = self.fb_address + (area.y1 * self.w + area.x1) * size
+        self.dma2d.start_copy(src, dst, w, h, self.w - w)
+
+    def _wait_dma2d(self, disp_drv):
+        # Called by LVGL while it waits for the buffer being flushed
+        if self.dma2d.done():
+            disp_drv.flush_ready()
+
+    def _flush_direct(self, disp_drv, area, color_p):
+        # In direct mode color_p points to the start of the screen sized buffer, copy the changed rows of the area
+        size = lv.color_t.__SIZE__
+        row = (area.x2 - area.x1 + 1) * size
+        pos = (area.y1 * self.w + area.x1) * size
+        stride = self.w * size
+        src = color_p.__dereference__(self.w * self.h * size)
+        fb = self.fb
+        for _ in range(area.y2 - area.y1 + 1):
+            fb[pos:pos + row] = src[pos:pos + row]
+            pos += stride
+        disp_drv.flush_ready()
+
+    def _flush_instrumented(self, disp_drv, area, color_p):
+        start = time.ticks_us()
+        self._flush(disp_drv, area, color_p)
+        self.flush_us += time.ticks_diff(time.ticks_us(), start)
+        self.flushes += 1
+        self.pixels += (area.x2 - area.x1 + 1) * (area.y2 - area.y1 + 1)
+
+    def _monitor(self, disp_drv, time_ms, px):
+        # Called by LVGL after every refresh with the time it took, including the flushes
+        self.frames += 1
+        self.refresh_ms += time_ms
+
+    def reset_stats(self):
+        self.stats_start = time.ticks_ms()
+        self.flushes = 0
+        self.pixels = 0
+        self.flush_us = 0
+        self.frames = 0
+        self.refresh_ms = 0
+
+    def stats(self):
+        '''
+        Returns the flush and render statistics since the last reset_stats() (only collected with instrument=True).
+        '''
+        elapsed_s = max(time.ticks_diff(time.ticks_ms(), self.stats_start), 1) / 1000
+        render_ms = max(self.refresh_ms - self.flush_us // 1000, 0)
+        return {
+            'flushes_per_s': self.flushes / elapsed_s,
+            'frames_per_s': self.frames / elapsed_s,
+            'pixels': self.pixels,
+            'flush_ms': self.flush_us / 1000,
+            'render_ms': render_ms,
+        }
 
     def __del__(self):
         stm32f429disc_disp.deinit()
@@ -51,17 +210,50 @@ class Display:
     def height(self):
         return self.h
 
-    def calibrate_touchscreen(self):
-        calibration_points = [
-            Calibration_Point(20,  20, 'upper left-hand corner'),
-            Calibration_Point(-40, -40, 'lower right-hand corner')
-        ]
-        calibration_gui = Calibration_GUI(self, calibration_points)
+    def calibrate_touchscreen(self, save=True):
+        '''
+        Runs the calibration UI. With the touch pipeline five points are fitted with an affine map,
+        otherwise the driver's two point calibration is used. With save the result is stored for
+        get_display() (see lab.touch.save_calibration()).
+        '''
+        if self.touch is not None:
+            calibration_points = [
+                Calibration_Point(20, 20, 'upper left-hand corner'),
+                Calibration_Point(-20, 20, 'upper right-hand corner'),
+                Calibration_Point(-20, -20, 'lower right-hand corner'),
+                Calibration_Point(20, -20, 'lower left-hand corner'),
+                Calibration_Point(self.w // 2, self.h // 2, 'center')
+            ]
+            # Collect uncalibrated coordinates
+            self.set_touch_calibration(None)
+        else:
+            calibration_points = [
+                Calibration_Point(20,  20, 'upper left-hand corner'),
+                Calibration_Point(-40, -40, 'lower right-hand corner')
+            ]
+            self.set_touch_calibration((0, 0, self.w, self.h))
+        calibration_gui = Calibration_GUI(self, calibration_points, save=save)
         calibration_gui.begin_calibration()
 
     def set_touchscreen_calibration_values(self, x1, y1, x2, y2):
         stm32f429disc_disp.ts_calibrate(x1=x1, y1=y1, x2=x2, y2=y2)
 
+    def set_touch_calibration(self, values):
+        '''
+        Applies a two point (4 values) or affine (6 values) calibration, None resets to the
+        uncalibrated driver coordinates.
+        '''
+        if values is not None and len(values) == 4:
+            self.set_touchscreen_calibration_values(*values)
+            if self.touch is not None:
+                self.touch.set_affine(_TOUCH_IDENTITY)
+            return
+        if self.touch is None:
+            raise ValueError('Affine touch calibration needs touch_filter=True')
+        # The driver passes its coordinates through, the pipeline maps them
+        self.set_touchscreen_calibration_values(*PASS_THROUGH_CALIBRATION)
+        self.touch.set_affine(_TOUCH_IDENTITY if values is None else values)
+
 
 # Point class holding display and touch coordiantes
 class Calibration_Point():
@@ -85,12 +277,15 @@ class Calibration_GUI():
     LV_COORD_MAX = const((1 << (8 * 2 - 1)) - 1000)
     LV_RADIUS_CIRCLE = const(LV_COORD_MAX) # TODO use lv.RADIUS_CIRCLE constant when it's available!
 
-    def __init__(self, display, points, touch_count=5):
+    def __init__(self, display, points, touch_count=5, save=False):
         self.display = display
         self.points = points
         self.touch_count = touch_count
+        self.save = save
 
         self.med = [lv.point_t() for i in range(0,self.touch_count)] # Storage point to calculate median
+        self.med_x = array('h', bytes(2 * touch_count))
+        self.med_y = array('h', bytes(2 * touch_count))
 
         self.cur_point = 0
         self.cur_touch = 0
@@ -152,23 +347,38 @@ class Calibration_GUI():
 
         self.cur_touch += 1
         if self.cur_touch == self.touch_count:
-            med_x = sorted([med.x for med in self.med])
-            med_y = sorted([med.y for med in self.med])
-            x = med_x[len(med_x) // 2]
-            y = med_y[len(med_y) // 2]
+            for i in range(self.touch_count):
+                self.med_x[i] = self.med[i].x
+                self.med_y[i] = self.med[i].y
+            x = median(self.med_x)
+            y = median(self.med_y)
             point.touch_coordinate = lv.point_t({'x': x, 'y': y})
             self.cur_point += 1
             self.cur_touch = 0
 
         if self.cur_point == len(self.points):
-            cal = self._calibrate()
-            self.show_text(f'Calibration result: x1={cal[0]}, y1={cal[1]}, x2={cal[2]}, y2={cal[3]}')
+            if len(self.points) > 2:
+                cal = self._calibrate_affine()
+                self.show_text('Calibration result:\n' + ', '.join(f'{c:.3f}' for c in cal))
+            else:
+                cal = tuple(round(c) for c in self._calibrate())
+                self.show_text(f'Calibration result: x1={cal[0]}, y1={cal[1]}, x2={cal[2]}, y2={cal[3]}')
+            self.display.set_touch_calibration(cal)
+            if self.save:
+                save_calibration(cal)
             self.cur_point = 0
             # self.show_text('Click/drag on screen\nto check calibration')
             # self.big_btn.add_event_cb(lambda event, self=self: self._check(event), lv.EVENT.PRESSING, None)
         else:
             self.show_circle()
 
+    def _calibrate_affine(self):
+        screen = [(p.display_coordinates.x, p.display_coordinates.y) for p in self.points]
+        touch = [(p.touch_coordinate.x, p.touch_coordinate.y) for p in self.points]
+        cal = fit_affine(screen, touch)
+        print(f'Calibration result: {cal}')
+        return cal
+
     def _calibrate(self):
         dx1 = self.points[0].display_coordinates.x
         dy1 = self.points[0].display_coordinates.y
@@ -0,0 +1,79 @@
+# Minimal register level access to the STM32F429 Chrom-ART (DMA2D) accelerator,
+# used by lab.display_tools to copy rendered areas to the LTDC frame buffer
+# without blocking the CPU.
+#
+# Completion is reported by the transfer complete flag. MicroPython offers no
+# way to attach a handler to the DMA2D interrupt line, so the flag is polled
+# (see done()); Display does that from LVGL's wait_cb, which LVGL only calls
+# once it needs the buffer back.
+
+import machine
+
+_RCC_AHB1ENR = const(0x40023830)
+_RCC_AHB1ENR_DMA2DEN = const(1 << 23)
+
+_DMA2D_BASE = const(0x4002B000)
+_CR = const(_DMA2D_BASE + 0x00)
+_ISR = const(_DMA2D_BASE + 0x04)
+_IFCR = const(_DMA2D_BASE + 0x08)
+_FGMAR = const(_DMA2D_BASE + 0x0C)
+_FGOR = const(_DMA2D_BASE + 0x10)
+_FGPFCCR = const(_DMA2D_BASE + 0x1C)
+_OPFCCR = const(_DMA2D_BASE + 0x34)
+_OMAR = const(_DMA2D_BASE + 0x3C)
+_OOR = const(_DMA2D_BASE + 0x40)
+_NLR = const(_DMA2D_BASE + 0x44)
+
+_CR_START = const(0x01)
+_CR_MODE_M2M = const(0x00 << 16)
+_ISR_TEIF = const(0x01)
+_ISR_TCIF = const(0x02)
+_IFCR_ALL = const(0x3F)
+
+CM_ARGB8888 = const(0)
+CM_RGB565 = const(2)
+
+
+class DMA2D:
+    '''
+    Memory to memory copies of rectangular areas. Only one transfer can be in flight at a time.
+    '''
+    def __init__(self, color_mode=CM_RGB565):
+        machine.mem32[_RCC_AHB1ENR] |= _RCC_AHB1ENR_DMA2DEN
+        machine.mem32[_FGPFCCR] = color_mode
+        machine.mem32[_OPFCCR] = color_mode
+        machine.mem32[_IFCR] = _IFCR_ALL
+        self.busy = False
+        self.errors = 0
+
+    def start_copy(self, src, dst, width, height, dst_offset):
+        '''
+        Starts copying width x height pixels from the contiguous buffer at address src to the address dst.
+        dst_offset is the number of pixels to skip at the end of each destination line.
+        '''
+        machine.mem32[_FGMAR] = src
+        machine.mem32[_FGOR] = 0
+        machine.mem32[_OMAR] = dst
+        machine.mem32[_OOR] = dst_offset
+        machine.mem32[_NLR] = (width << 16) | height
+        machine.mem32[_IFCR] = _IFCR_ALL
+        self.busy = True
+        machine.mem32[_CR] = _CR_MODE_M2M | _CR_START
+
+    def done(self):
+        '''
+        Returns True once the last transfer has completed (or failed, which is counted in errors).
+        '''
+        if self.busy:
+            isr = machine.mem32[_ISR]
+            if isr & _ISR_TEIF:
+                self.errors += 1
+            elif not isr & _ISR_TCIF:
+                return False
+            machine.mem32[_IFCR] = _IFCR_ALL
+            self.busy = False
+        return True
+
+    def wait(self):
+        while not self.done():
+            pass
@@ -0,0 +1,719 @@
+# Based on https://github.com/micropython-IMU/micropython-fusion
+
+# Original Header:
+# Sensor fusion for the micropython board. 25th June 2015
+# Ported to MicroPython by Peter Hinch.
+# Released under the MIT License (MIT)
+# Copyright (c) 2017, 2018 Peter Hinch
+
+# Hardware independent part of the sensor fusion, so it also runs on a host
+# (see lab.vclock). lab.gyro_tools re-exports the filters and check_kernel.
+
+from array import array
+from math import sqrt, sin, cos, atan2, asin, degrees, pi
+
+from lab.deltat import DeltaT, DeltaTUs, FixedDeltaT
+
+
+# Scale factors from the driver units to rad/s
+_MDPS_TO_RAD = pi / 180000
+
+
+def _integrate_ref(q, gx, gy, gz, k):
+    '''
+    Reference quaternion integrate-and-normalise step, updating q in place.
+    k scales the angular rates to rad/s and multiplies by the time step.
+    lab.fusion_native holds a compiled copy which must stay in sync with this.
+    '''
+    q1 = q[0]
+    q2 = q[1]
+    q3 = q[2]
+    q4 = q[3]
+
+    # Compute rate of change of quaternion and integrate
+    k *= 0.5
+    gx *= k
+    gy *= k
+    gz *= k
+    q1 += -q2 * gx - q3 * gy - q4 * gz  # - self.beta * s1
+    q2 += q[0] * gx + q3 * gz - q4 * gy  # - self.beta * s2
+    q3 += q[0] * gy - q[1] * gz + q4 * gx  # - self.beta * s3
+    q4 += q[0] * gz + q[1] * gy - q[2] * gx  # - self.beta * s4
+
+    norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
+    q[0] = q1 * norm
+    q[1] = q2 * norm
+    q[2] = q3 * norm
+    q[3] = q4 * norm
+
+
+def _integrate_batch_ref(q, g, n, k, offset):
+    '''
+    Reference batch step: the same arithmetic as _integrate_ref() for the n quaternions packed in q,
+    with the rates of sensor i at g[offset + 3 * i].
+    '''
+    k *= 0.5
+    j = offset
+    for i in range(0, 4 * n, 4):
+        gx = g[j] * k
+        gy = g[j + 1] * k
+        gz = g[j + 2] * k
+        j += 3
+        q1 = q[i]
+        q2 = q[i + 1]
+        q3 = q[i + 2]
+        q4 = q[i + 3]
+        q1 += -q2 * gx - q3 * gy - q4 * gz
+        q2 += q[i] * gx + q3 * gz - q4 * gy
+        q3 += q[i] * gy - q[i + 1] * gz + q4 * gx
+        q4 += q[i] * gz + q[i + 1] * gy - q[i + 2] * gx
+        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)
+        q[i] = q1 * norm
+        q[i + 1] = q2 * norm
+        q[i + 2] = q3 * norm
+        q[i + 3] = q4 * norm
+
+
+# Use the native code emitter where available, the reference implementation otherwise
+try:
+    from lab.fusion_native import integrate as _integrate, integrate_batch as _integrate_batch
+except (ImportError, SyntaxError):
+    _integrate = _integrate_ref
+    _integrate_batch = _integrate_batch_ref
+
+# NumPy, for the vectorised GyroBatch on a host
+try:
+    import numpy as _np
+except ImportError:
+    _np = None
+
+
+def check_kernel(samples=1000, kernel=None):
+    '''
+    Runs the selected (or given) integration kernel and the reference implementation side by side
+    on a deterministic sequence of raw mdps samples and returns the number of quaternion
+    components which are not bit-identical. 0 means the fast path can be trusted.
+    '''
+    if kernel is None:
+        kernel = _integrate
+    q_ref = array('f', (1.0, 0.0, 0.0, 0.0))
+    q_fast = array('f', (1.0, 0.0, 0.0, 0.0))
+    k = _MDPS_TO_RAD * 0.001                # 1 kHz sample rate
+    seed = 12345
+    mismatches = 0
+    for _ in range(samples):
+        # Simple LCG, spread over the +-500 dps full scale range
+        seed = (seed * 1103515245 + 12345) & 0x7fffffff
+        x = seed % 1000001 - 500000
+        seed = (seed * 1103515245 + 12345) & 0x7fffffff
+        y = seed % 1000001 - 500000
+        seed = (seed * 1103515245 + 12345) & 0x7fffffff
+        z = seed % 1000001 - 500000
+        _integrate_ref(q_ref, x, y, z, k)
+        kernel(q_fast, x, y, z, k)
+        for i in range(4):
+            if q_ref[i] != q_fast[i]:
+                mismatches += 1
+                q_fast[i] = q_ref[i]        # resync so one error is not counted repeatedly
+    return mismatches
+
+
+def check_batch_kernel(samples=200, n=4):
+    '''
+    As check_kernel() for the batch kernel: n sensors integrated with the selected batch kernel
+    against _integrate_ref() per sensor. Returns the number of mismatching components.
+    '''
+    q_ref = array('f', (1.0, 0.0, 0.0, 0.0) * n)
+    q_fast = array('f', (1.0, 0.0, 0.0, 0.0) * n)
+    g = array('f', bytes(12 * n))
+    one = array('f', bytes(16))
+    k = _MDPS_TO_RAD * 0.001
+    seed = 12345
+    mismatches = 0
+    for _ in range(samples):
+        for i in range(3 * n):
+            seed = (seed * 1103515245 + 12345) & 0x7fffffff
+            g[i] = seed % 1000001 - 500000
+        for s in range(n):
+            for i in range(4):
+                one[i] = q_ref[4 * s + i]
+            _integrate_ref(one, g[3 * s], g[3 * s + 1], g[3 * s + 2], k)
+            for i in range(4):
+                q_ref[4 * s + i] = one[i]
+        _integrate_batch(q_fast, g, n, k, 0)
+        for i in range(4 * n):
+            if q_ref[i] != q_fast[i]:
+                mismatches += 1
+                q_fast[i] = q_ref[i]
+    return mismatches
+
+
+class GyroMadgwick:
+    '''
+    Class provides sensor fusion allowing heading, pitch and roll to be extracted. This uses the Madgwick algorithm.
+    The update method must be called peiodically. The calculations take 1.6mS on the Pyboard.
+    Under MicroPython the integration step runs as native code (see lab.fusion_native and check_kernel()).
+    The quaternion is kept in a preallocated array('f') which is updated in place, so update_mdps() does not
+    allocate any container objects per sample.
+    heading, pitch and roll are only computed from the quaternion when they are read, and cached until
+    the next update.
+    '''
+    __slots__ = ('deltat', '_k', 'q', '_pitch', '_roll', '_stale')
+    declination = 0                         # Optional offset for true north. A +ve value adds to heading
+    def __init__(self, timediff=None, deltat=None):
+        # deltat may be any of the lab.deltat classes, e.g. DeltaTUs() or FixedDeltaT(1e6 / odr)
+        self.set_deltat(DeltaT(timediff) if deltat is None else deltat)     # Time between updates
+        self.q = array('f', (1.0, 0.0, 0.0, 0.0))   # vector to hold quaternion
+        self._pitch = 0
+        self._roll = 0
+        self._stale = False
+
+    def set_deltat(self, deltat):
+        self.deltat = deltat
+        # mdps to rad/s and the time unit of deltat folded into one constant
+        self._k = _MDPS_TO_RAD * deltat.scale
+
+    def quaternion(self):
+        '''
+        Returns the current quaternion (w, x, y, z) without any conversion. The array is updated in place.
+        '''
+        return self.q
+
+    @property
+    def heading(self):
+        return 0
+
+    @property
+    def pitch(self):
+        if self._stale:
+            self._update_euler()
+        return self._pitch
+
+    @property
+    def roll(self):
+        if self._stale:
+            self._update_euler()
+        return self._roll
+
+    def update(self, gyro_dps, ts=None):
+        gx, gy, gz = gyro_dps               # Units deg/s
+        self._integrate(gx, gy, gz, 1000 * self._k * self.deltat(ts))
+
+    def update_mdps(self, x, y, z, ts=None):
+        '''
+        Same as update() but takes the raw millidegree/s integers returned by Gyro.read_xyz()
+        as separate arguments, so no tuple or generator has to be built by the caller.
+        ts is only needed if a timediff function was passed to the constructor.
+        '''
+        self._integrate(x, y, z, self._k * self.deltat(ts))
+
+    def update_ring(self, ring, head=None):
+        '''
+        Integrates all samples waiting in a SampleRing (see Gyro.enable_irq()), using the
+        timestamps captured in the interrupt handler. deltat must accept timestamps, e.g. DeltaTUs(True).
+        head limits the update to the samples before that slot. Returns the number of samples processed.
+        '''
+        q = self.q
+        k = self._k
+        deltat = self.deltat
+        ts = ring.ts
+        xyz = ring.xyz
+        mask = ring.mask
+        tail = ring.tail
+        if head is None:
+            head = ring.head
+        count = (head - tail) & mask
+        while tail != head:
+            i = 3 * tail
+            _integrate(q, xyz[i], xyz[i + 1], xyz[i + 2], k * deltat(ts[tail]))
+            tail = (tail + 1) & mask
+        ring.tail = tail
+        if count:
+            self._stale = True
+        return count
+
+    def update_block(self, buf, count, mdps_per_lsb=1, dt=None, ts=None):
+        '''
+        Integrates count x, y, z samples from buf (as filled by Gyro.read_block()) in one call.
+        dt is the sample period in seconds. For FIFO data, which is clocked by the sensor, pass
+        1 / Gyro.odr or construct with deltat=FixedDeltaT(1000000 / Gyro.odr, True) and pass the block
+        timestamp as ts to get jitter statistics. Otherwise the time since the previous update is
+        spread evenly over the block.
+        '''
+        if not count:
+            return
+        if dt is not None:
+            k = mdps_per_lsb * _MDPS_TO_RAD * dt
+        elif isinstance(self.deltat, FixedDeltaT):
+            k = mdps_per_lsb * self._k * self.deltat(ts)
+        else:
+            k = mdps_per_lsb * self._k * self.deltat(ts) / count
+        q = self.q
+        for i in range(0, 3 * count, 3):
+            _integrate(q, buf[i], buf[i + 1], buf[i + 2], k)
+        self._stale = True
+
+    def _integrate(self, gx, gy, gz, k):
+        # k scales the angular rates to rad/s and multiplies by the time step
+        _integrate(self.q, gx, gy, gz, k)
+        self._stale = True
+
+    def _update_euler(self):
+        q = self.q
+        self._stale = False
+        self._pitch = degrees(-asin(max(-1.0, min(1.0, 2.0 * (q[1] * q[3] - q[0] * q[2])))))
+        self._roll = degrees(atan2(2.0 * (q[0] * q[1] + q[2] * q[3]),
+            q[0] * q[0] - q[1] * q[1] - q[2] * q[2] + q[3] * q[3]))
+
+    def run(self, gyro_obj=None, iterations=0, infinite=True, prefilter=None):
+        # prefilter is an optional lab.gyro_filters.Pipeline applied to the samples before integration.
+        # With interrupt driven sampling (Gyro.enable_irq()) None is yielded while no sample is waiting,
+        # so a task pulling from run() can pass control to its scheduler instead of blocking the others
+        if gyro_obj is None:
+            from lab.gyro_tools import get_gyro
+            gyro_obj = get_gyro()
+        ring = getattr(gyro_obj, 'ring', None)
+        if ring is not None:
+            yield from self._run_ring(ring, iterations, infinite, prefilter)
+            return
+        while infinite or iterations > 0:
+            x, y, z = gyro_obj.read_xyz()
+            if prefilter is not None:
+                xyz = prefilter.filter(x, y, z)
+                x, y, z = xyz[0], xyz[1], xyz[2]
+            self.update_mdps(x, y, z)
+            if not infinite:
+                iterations -= 1
+            yield self.pitch, self.roll
+
+    def _run_ring(self, ring, iterations, infinite, prefilter):
+        if not self.deltat.expect_ts:
+            self.set_deltat(DeltaTUs(True))
+        while infinite or iterations > 0:
+            if not len(ring):
+                yield None
+                continue
+            # The interrupt keeps pushing, so filter and integrate up to the same slot
+            head = ring.head
+            if prefilter is not None:
+                prefilter.process_ring(ring, head)
+            n = self.update_ring(ring, head)
+            if not infinite:
+                iterations -= n
+            yield self.pitch, self.roll
+
+
+class OrientationFilter:
+    '''
+    Common interface of the orientation filters below, also implemented by GyroMadgwick (gyro only):
+    constructed with a timediff function or a lab.deltat object like GyroMadgwick, fed with
+    update_mdps(x, y, z, ts) from Gyro.read_xyz() and read through pitch, roll, heading (degrees) and
+    quaternion(). The filters here also take an accelerometer with update_imu(); without one they
+    reduce to gyro integration. heading is integrated yaw, there is no magnetometer to correct it.
+    Subclasses implement _step() with the angular rates in rad/s and the time step in seconds.
+    '''
+    def __init__(self, timediff=None, deltat=None):
+        self.set_deltat(DeltaT(timediff) if deltat is None else deltat)
+        self.q = array('f', (1.0, 0.0, 0.0, 0.0))
+        self._euler = array('f', (0.0, 0.0, 0.0))  # pitch, roll, heading
+        self._stale = False
+
+    def set_deltat(self, deltat):
+        self.deltat = deltat
+        self._scale = deltat.scale
+
+    def quaternion(self):
+        return self.q
+
+    @property
+    def pitch(self):
+        if self._stale:
+            self._update_euler()
+        return self._euler[0]
+
+    @property
+    def roll(self):
+        if self._stale:
+            self._update_euler()
+        return self._euler[1]
+
+    @property
+    def heading(self):
+        if self._stale:
+            self._update_euler()
+        return self._euler[2]
+
+    def update(self, gyro_dps, ts=None, accel=None):
+        gx, gy, gz = gyro_dps
+        if accel is None:
+            self.update_imu(1000 * gx, 1000 * gy, 1000 * gz, 0, 0, 0, ts)
+        else:
+            self.update_imu(1000 * gx, 1000 * gy, 1000 * gz, accel[0], accel[1], accel[2], ts)
+
+    def update_mdps(self, x, y, z, ts=None):
+        self.update_imu(x, y, z, 0, 0, 0, ts)
+
+    def update_imu(self, gx, gy, gz, ax, ay, az, ts=None):
+        '''
+        gx, gy, gz in mdps as from Gyro.read_xyz(), ax, ay, az in any unit (only the direction is used),
+        z pointing up when the board lies flat. An all zero acceleration means no measurement.
+        '''
+        self._step(gx * _MDPS_TO_RAD, gy * _MDPS_TO_RAD, gz * _MDPS_TO_RAD, ax, ay, az,
+                   self.deltat(ts) * self._scale)
+        self._stale = True
+
+    def _step(self, gx, gy, gz, ax, ay, az, dt):
+        raise NotImplementedError
+
+    def _update_euler(self):
+        q = self.q
+        e = self._euler
+        self._stale = False
+        e[0] = degrees(-asin(max(-1.0, min(1.0, 2.0 * (q[1] * q[3] - q[0] * q[2])))))
+        e[1] = degrees(atan2(2.0 * (q[0] * q[1] + q[2] * q[3]),
+                             q[0] * q[0] - q[1] * q[1] - q[2] * q[2] + q[3] * q[3]))
+        e[2] = degrees(atan2(2.0 * (q[0] * q[3] + q[1] * q[2]),
+                             q[0] * q[0] + q[1] * q[1] - q[2] * q[2] - q[3] * q[3]))
+
+    def run(self, gyro_obj=None, iterations=0, infinite=True, accel_obj=None):
+        # accel_obj is anything with a read_xyz() returning the acceleration, see update_imu()
+        if gyro_obj is None:
+            from lab.gyro_tools import get_gyro
+            gyro_obj = get_gyro()
+        while infinite or iterations > 0:
+            x, y, z = gyro_obj.read_xyz()
+            if accel_obj is None:
+                self.update_mdps(x, y, z)
+            else:
+                ax, ay, az = accel_obj.read_xyz()
+                self.update_imu(x, y, z, ax, ay, az)
+            if not infinite:
+                iterations -= 1
+            yield self.pitch, self.roll
+
+
+class Madgwick(OrientationFilter):
+    '''
+    Madgwick's IMU filter: gyro integration corrected by a gradient descent step towards the
+    orientation in which gravity points along the measured acceleration, weighted by beta (rad/s).
+    '''
+    def __init__(self, timediff=None, deltat=None, beta=0.1):
+        super().__init__(timediff, deltat)
+        self.beta = beta
+
+    def _step(self, gx, gy, gz, ax, ay, az, dt):
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+
+        # Rate of change of quaternion from gyroscope
+        qdot0 = 0.5 * (-q1 * gx - q2 * gy - q3 * gz)
+        qdot1 = 0.5 * (q0 * gx + q2 * gz - q3 * gy)
+        qdot2 = 0.5 * (q0 * gy - q1 * gz + q3 * gx)
+        qdot3 = 0.5 * (q0 * gz + q1 * gy - q2 * gx)
+
+        if ax or ay or az:
+            norm = 1 / sqrt(ax * ax + ay * ay + az * az)
+            ax *= norm
+            ay *= norm
+            az *= norm
+            _2q0 = 2 * q0
+            _2q1 = 2 * q1
+            _2q2 = 2 * q2
+            _2q3 = 2 * q3
+            _4q0 = 4 * q0
+            _4q1 = 4 * q1
+            _4q2 = 4 * q2
+            _8q1 = 8 * q1
+            _8q2 = 8 * q2
+            q0q0 = q0 * q0
+            q1q1 = q1 * q1
+            q2q2 = q2 * q2
+            q3q3 = q3 * q3
+
+            # Gradient descent corrective step
+            s0 = _4q0 * q2q2 + _2q2 * ax + _4q0 * q1q1 - _2q1 * ay
+            s1 = _4q1 * q3q3 - _2q3 * ax + 4 * q0q0 * q1 - _2q0 * ay - _4q1 + _8q1 * q1q1 + _8q1 * q2q2 + _4q1 * az
+            s2 = 4 * q0q0 * q2 + _2q0 * ax + _4q2 * q3q3 - _2q3 * ay - _4q2 + _8q2 * q1q1 + _8q2 * q2q2 + _4q2 * az
+            s3 = 4 * q1q1 * q3 - _2q1 * ax + 4 * q2q2 * q3 - _2q2 * ay
+            norm = s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3
+            if norm:
+                norm = self.beta / sqrt(norm)
+                qdot0 -= norm * s0
+                qdot1 -= norm * s1
+                qdot2 -= norm * s2
+                qdot3 -= norm * s3
+
+        q0 += qdot0 * dt
+        q1 += qdot1 * dt
+        q2 += qdot2 * dt
+        q3 += qdot3 * dt
+        norm = 1 / sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        q[0] = q0 * norm
+        q[1] = q1 * norm
+        q[2] = q2 * norm
+        q[3] = q3 * norm
+
+
+class Mahony(OrientationFilter):
+    '''
+    Mahony's complementary filter on SO(3): the cross product between measured and estimated gravity
+    is fed back to the angular rate with proportional gain kp and integral gain ki (which also
+    estimates the gyro bias).
+    '''
+    def __init__(self, timediff=None, deltat=None, kp=1.0, ki=0.0):
+        super().__init__(timediff, deltat)
+        self.kp = kp
+        self.ki = ki
+        self.integral = array('f', (0.0, 0.0, 0.0))
+
+    def _step(self, gx, gy, gz, ax, ay, az, dt):
+        q = self.q
+        q0 = q[0]
+        q1 = q[1]
+        q2 = q[2]
+        q3 = q[3]
+
+        if ax or ay or az:
+            norm = 1 / sqrt(ax * ax + ay * ay + az * az)
+            ax *= norm
+            ay *= norm
+            az *= norm
+
+            # Estimated direction of gravity and error to the measured one
+            vx = q1 * q3 - q0 * q2
+            vy = q0 * q1 + q2 * q3
+            vz = q0 * q0 - 0.5 + q3 * q3
+            ex = ay * vz - az * vy
+            ey = az * vx - ax * vz
+            ez = ax * vy - ay * vx
+
+            if self.ki > 0:
+                integral = self.integral
+                k = 2 * self.ki * dt
+                integral[0] += k * ex
+                integral[1] += k * ey
+                integral[2] += k * ez
+                gx += integral[0]
+                gy += integral[1]
+                gz += integral[2]
+            k = 2 * self.kp
+            gx += k * ex
+            gy += k * ey
+            gz += k * ez
+
+        k = 0.5 * dt
+        gx *= k
+        gy *= k
+        gz *= k
+        q0 += -q[1] * gx - q2 * gy - q3 * gz
+        q1 += q[0] * gx + q2 * gz - q3 * gy
+        q2 += q[0] * gy - q[1] * gz + q3 * gx
+        q3 += q[0] * gz + q[1] * gy - q[2] * gx
+        norm = 1 / sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+        q[0] = q0 * norm
+        q[1] = q1 * norm
+        q[2] = q2 * norm
+        q[3] = q3 * norm
+
+
+class Complementary(OrientationFilter):
+    '''
+    Cheapest of the filters: integrates the Euler angles directly from the gyro and blends pitch and
+    roll with the tilt from the accelerometer, keeping alpha of the gyro estimate per update.
+    Inaccurate close to +-90 degrees pitch. quaternion() is computed from the angles when called.
+    '''
+    def __init__(self, timediff=None, deltat=None, alpha=0.98):
+        super().__init__(timediff, deltat)
+        self.alpha = alpha
+        self._angles = array('f', (0.0, 0.0, 0.0))    # pitch, roll, yaw in radians
+
+    def _step(self, gx, gy, gz, ax, ay, az, dt):
+        a = self._angles
+        pitch = a[0]
+        roll = a[1]
+        sr = sin(roll)
+        cr = cos(roll)
+        cp = cos(pitch)
+        cp = cp if cp > 1e-3 else 1e-3
+        t = gy * sr + gz * cr
+        roll += (gx + t * sin(pitch) / cp) * dt
+        pitch += (gy * cr - gz * sr) * dt
+        a[2] += t / cp * dt
+
+        if ax or ay or az:
+            alpha = self.alpha
+            acc_roll = atan2(ay, az)
+            # Blend along the shorter way round at the +-180 degrees wrap
+            d = acc_roll - roll
+            if d > pi:
+                d -= 2 * pi
+            elif d < -pi:
+                d += 2 * pi
+            roll += (1 - alpha) * d
+            pitch = alpha * pitch + (1 - alpha) * atan2(-ax, sqrt(ay * ay + az * az))
+
+        if roll > pi:
+            roll -= 2 * pi
+        elif roll < -pi:
+            roll += 2 * pi
+        a[0] = pitch
+        a[1] = roll
+
+    def quaternion(self):
+        a = self._angles
+        cp = cos(0.5 * a[0])
+        sp = sin(0.5 * a[0])
+        cr = cos(0.5 * a[1])
+        sr = sin(0.5 * a[1])
+        cy = cos(0.5 * a[2])
+        sy = sin(0.5 * a[2])
+        q = self.q
+        q[0] = cr * cp * cy + sr * sp * sy
+        q[1] = sr * cp * cy - cr * sp * sy
+        q[2] = cr * sp * cy + sr * cp * sy
+        q[3] = cr * cp * sy - sr * sp * cy
+        return q
+
+    def _update_euler(self):
+        a = self._angles
+        e = self._euler
+        self._stale = False
+        e[0] = degrees(a[0])
+        e[1] = degrees(a[1])
+        e[2] = degrees(atan2(sin(a[2]), cos(a[2])))
+
+
+# Filters by name, for selecting one in configuration or benchmarks
+FILTERS = {
+    'gyro': GyroMadgwick,
+    'madgwick': Madgwick,
+    'mahony': Mahony,
+    'complementary': Complementary,
+}
+
+
+class GyroBatch:
+    '''
+    Gyro-only fusion of n sensors sampled together, as n GyroMadgwick objects would do it but with
+    one call per sample for all sensors. The quaternions are packed in one array('f') (w, x, y, z of
+    sensor 0, then sensor 1, ...), which the batch kernel updates in place; the sensors share the
+    timing from deltat (see GyroMadgwick). On a host with NumPy and at least numpy_min sensors (or
+    with use_numpy=True) q is an n x 4 float64 array and each step is vectorised over the sensors
+    instead; below numpy_min the per call overhead of NumPy outweighs the vectorisation.
+    '''
+    def __init__(self, n, timediff=None, deltat=None, use_numpy=None, numpy_min=16):
+        self.n = n
+        self.set_deltat(DeltaT(timediff) if deltat is None else deltat)
+        self.numpy = _np is not None and n >= numpy_min if use_numpy is None else use_numpy
+        if self.numpy:
+            self.q = _np.zeros((n, 4))
+            self.q[:, 0] = 1.0
+            self._angles = _np.zeros((n, 2))
+        else:
+            self.q = array('f', (1.0, 0.0, 0.0, 0.0) * n)
+            self._angles = array('f', bytes(8 * n))     # pitch, roll of each sensor
+        self._stale = False
+
+    def set_deltat(self, deltat):
+        self.deltat = deltat
+        self._k = _MDPS_TO_RAD * deltat.scale
+
+    def quaternion(self, i):
+        '''
+        Returns the quaternion of sensor i as a view into q, updated in place.
+        '''
+        if self.numpy:
+            return self.q[i]
+        return memoryview(self.q)[4 * i:4 * i + 4]
+
+    def update_mdps(self, rates, ts=None):
+        '''
+        rates holds x, y, z in mdps for every sensor in turn: an array('f') of 3 * n values, on the
+        NumPy path anything reshapeable to n x 3.
+        '''
+        k = self._k * self.deltat(ts)
+        if self.numpy:
+            self._step_numpy(_np.reshape(rates, (self.n, 3)), k)
+        else:
+            _integrate_batch(self.q, rates, self.n, k, 0)
+        self._stale = True
+
+    def update_block(self, block, count, dt=None, ts=None):
+        '''
+        Integrates count samples of all sensors from block, laid out sample by sample as for
+        update_mdps(). dt is the sample period in seconds. With a FixedDeltaT its period is used,
+        otherwise the time since the previous update is spread evenly over the block.
+        '''
+        if not count:
+            return
+        if dt is not None:
+            k = _MDPS_TO_RAD * dt
+        elif isinstance(self.deltat, FixedDeltaT):
+            k = self._k * self.deltat(ts)
+        else:
+            k = self._k * self.deltat(ts) / count
+        n = self.n
+        if self.numpy:
+            block = _np.reshape(block[:3 * n * count], (count, n, 3))
+            for s in range(count):
+                self._step_numpy(block[s], k)
+        else:
+            q = self.q
+            for offset in range(0, 3 * n * count, 3 * n):
+                _integrate_batch(q, block, n, k, offset)
+        self._stale = True
+
+    def _step_numpy(self, g, k):
+        g = g * (0.5 * k)
+        gx, gy, gz = g[:, 0], g[:, 1], g[:, 2]
+        w, x, y, z = self.q.T
+        q = _np.stack((
+            w - x * gx - y * gy - z * gz,
+            x + w * gx + y * gz - z * gy,
+            y + w * gy - x * gz + z * gx,
+            z + w * gz + x * gy - y * gx,
+        ), axis=1)
+        q /= _np.sqrt(_np.einsum('ij,ij->i', q, q))[:, None]
+        # In place, so the views returned by quaternion() stay current
+        self.q[...] = q
+
+    def pitch(self, i):
+        if self._stale:
+            self._update_euler()
+        if self.numpy:
+            return self._angles[i, 0]
+        return self._angles[2 * i]
+
+    def roll(self, i):
+        if self._stale:
+            self._update_euler()
+        if self.numpy:
+            return self._angles[i, 1]
+        return self._angles[2 * i + 1]
+
+    def angles(self):
+        '''
+        Returns pitch and roll in degrees of all sensors: an array('f') of pitch, roll pairs, or an
+        n x 2 array on the NumPy path.
+        '''
+        if self._stale:
+            self._update_euler()
+        return self._angles
+
+    def _update_euler(self):
+        self._stale = False
+        q = self.q
+        if self.numpy:
+            w, x, y, z = q.T
+            self._angles[:, 0] = _np.degrees(-_np.arcsin(_np.clip(2.0 * (x * z - w * y), -1.0, 1.0)))
+            self._angles[:, 1] = _np.degrees(_np.arctan2(2.0 * (w * x + y * z), w * w - x * x - y * y + z * z))
+            return
+        a = self._angles
+        for i in range(self.n):
+            j = 4 * i
+            a[2 * i] = degrees(-asin(max(-1.0, min(1.0, 2.0 * (q[j + 1] * q[j + 3] - q[j] * q[j + 2])))))
+            a[2 * i + 1] = degrees(atan2(2.0 * (q[j] * q[j + 1] + q[j + 2] * q[j + 3]),
+                q[j] * q[j] - q[j + 1] * q[j + 1] - q[j + 2] * q[j + 2] + q[j + 3] * q[j + 3]))
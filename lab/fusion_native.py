@@ -0,0 +1,56 @@
+# Native code versions of the sensor fusion kernels in lab.fusion.
+# Importing this module fails on CPython (no micropython module) and on ports
+# built without the native emitter; lab.fusion then falls back to the
+# pure Python reference implementation.
+# The arithmetic has to be kept in the same order as the reference so that
+# both produce bit-identical results (see fusion.check_kernel()).
+
+import micropython
+from math import sqrt
+
+
+@micropython.native
+def integrate(q, gx, gy, gz, k):
+    q1 = q[0]
+    q2 = q[1]
+    q3 = q[2]
+    q4 = q[3]
+
+    k *= 0.5
+    gx *= k
+    gy *= k
+    gz *= k
+    q1 += -q2 * gx - q3 * gy - q4 * gz
+    q2 += q[0] * gx + q3 * gz - q4 * gy
+    q3 += q[0] * gy - q[1] * gz + q4 * gx
+    q4 += q[0] * gz + q[1] * gy - q[2] * gx
+
+    norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)
+    q[0] = q1 * norm
+    q[1] = q2 * norm
+    q[2] = q3 * norm
+    q[3] = q4 * norm
+
+
+@micropython.native
+def integrate_batch(q, g, n, k, offset):
+    k *= 0.5
+    j = offset
+    for i in range(0, 4 * n, 4):
+        gx = g[j] * k
+        gy = g[j + 1] * k
+        gz = g[j + 2] * k
+        j += 3
+        q1 = q[i]
+        q2 = q[i + 1]
+        q3 = q[i + 2]
+        q4 = q[i + 3]
+        q1 += -q2 * gx - q3 * gy - q4 * gz
+        q2 += q[i] * gx + q3 * gz - q4 * gy
+        q3 += q[i] * gy - q[i + 1] * gz + q4 * gx
+        q4 += q[i] * gz + q[i + 1] * gy - q[i + 2] * gx
+        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)
+        q[i] = q1 * norm
+        q[i + 1] = q2 * norm
+        q[i + 2] = q3 * norm
+        q[i + 3] = q4 * norm
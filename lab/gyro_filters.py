@@ -0,0 +1,200 @@
+# Pre-filter stages between Gyro and GyroMadgwick.
+#
+# Every stage works in place on a block of x, y, z triples in an array('f'),
+# e.g. mdps from Gyro.read_xyz() or a SampleRing, or raw counts converted from
+# Gyro.read_block(). Stages keep their state in preallocated arrays, so
+# filtering does not allocate any container objects per sample. A Pipeline
+# chains them and can be handed to GyroMadgwick.run(prefilter=...):
+#
+#   pipeline = Pipeline(SpikeReject(limit=20000), BiasEstimator(), LowPass(lowpass_alpha(50, 760)))
+#   for pitch, roll in gm.run(gyro, prefilter=pipeline):
+#       ...
+
+from array import array
+from math import exp, pi
+
+_BIG = 3.0e38
+
+
+def lowpass_alpha(cutoff_hz, odr):
+    '''
+    Returns the LowPass coefficient for a cutoff frequency at the output data rate odr.
+    '''
+    return 1 - exp(-2 * pi * cutoff_hz / odr)
+
+
+class BiasEstimator:
+    '''
+    Subtracts the zero-rate offset. Samples are collected in windows of window samples; when the
+    peak to peak range of all three axes in a window stays below threshold (in the units of the
+    samples, e.g. mdps) the sensor is taken to be stationary and the window mean is blended into the
+    bias with weight alpha. The first stationary window sets the bias directly.
+    '''
+    __slots__ = ('threshold', 'window', 'alpha', 'bias', 'n', 'updates', 'stationary', '_acc')
+
+    def __init__(self, threshold=1000, window=100, alpha=0.2, bias=None):
+        self.threshold = threshold
+        self.window = window
+        self.alpha = alpha
+        self.bias = array('f', bias or (0.0, 0.0, 0.0))
+        self._acc = array('f', bytes(36))   # sum x, y, z, min x, y, z, max x, y, z of the window
+        self.updates = 0
+        self.stationary = False             # Whether the last complete window was stationary
+        self._clear()
+
+    def _clear(self):
+        acc = self._acc
+        for a in range(3):
+            acc[a] = 0.0
+            acc[3 + a] = _BIG
+            acc[6 + a] = -_BIG
+        self.n = 0
+
+    def process(self, buf, start, count):
+        bias = self.bias
+        acc = self._acc
+        for i in range(3 * start, 3 * (start + count)):
+            a = i % 3
+            v = buf[i]
+            acc[a] += v
+            if v < acc[3 + a]:
+                acc[3 + a] = v
+            if v > acc[6 + a]:
+                acc[6 + a] = v
+            buf[i] = v - bias[a]
+            if a == 2:
+                self.n += 1
+                if self.n >= self.window:
+                    self._end_window()
+
+    def _end_window(self):
+        acc = self._acc
+        threshold = self.threshold
+        self.stationary = (acc[6] - acc[3] < threshold and acc[7] - acc[4] < threshold
+                           and acc[8] - acc[5] < threshold)
+        if self.stationary:
+            alpha = self.alpha if self.updates else 1.0
+            n = self.n
+            bias = self.bias
+            for a in range(3):
+                bias[a] += alpha * (acc[a] / n - bias[a])
+            self.updates += 1
+        self._clear()
+
+
+class LowPass:
+    '''
+    First order IIR low-pass y += alpha * (x - y) on each axis, see lowpass_alpha().
+    '''
+    __slots__ = ('alpha', 'y', 'primed')
+
+    def __init__(self, alpha=0.5):
+        self.alpha = alpha
+        self.y = array('f', bytes(12))
+        self.primed = False
+
+    def process(self, buf, start, count):
+        y = self.y
+        alpha = self.alpha
+        i = 3 * start
+        if count and not self.primed:
+            # Start from the first sample instead of ramping up from 0
+            y[0], y[1], y[2] = buf[i], buf[i + 1], buf[i + 2]
+            self.primed = True
+        for i in range(i, 3 * (start + count)):
+            a = i % 3
+            y[a] += alpha * (buf[i] - y[a])
+            buf[i] = y[a]
+
+
+class SpikeReject:
+    '''
+    Median of 3 spike rejection on each axis. Without limit every sample is replaced by the median of
+    itself and the two previous raw samples (one sample delay). With limit a sample is only replaced if
+    it is more than limit away from that median, so normal samples pass unchanged.
+    rejected counts the replaced samples.
+    '''
+    __slots__ = ('limit', 'hist', 'rejected', 'primed')
+
+    def __init__(self, limit=None):
+        self.limit = limit
+        self.hist = array('f', bytes(24))   # x, y, z two samples ago, x, y, z one sample ago
+        self.rejected = 0
+        self.primed = False
+
+    def process(self, buf, start, count):
+        hist = self.hist
+        if count and not self.primed:
+            # Start from the first sample instead of zeros, which would flag it as a spike
+            for a in range(3):
+                hist[a] = hist[3 + a] = buf[3 * start + a]
+            self.primed = True
+        limit = self.limit
+        for i in range(3 * start, 3 * (start + count)):
+            a = i % 3
+            v = buf[i]
+            p2 = hist[a]
+            p1 = hist[3 + a]
+            # Median of p2, p1 and v without sorting
+            if p2 > p1:
+                p2, p1 = p1, p2
+            m = p2 if v < p2 else p1 if v > p1 else v
+            hist[a] = hist[3 + a]
+            hist[3 + a] = v
+            if limit is None:
+                buf[i] = m
+            elif v - m > limit or m - v > limit:
+                buf[i] = m
+                self.rejected += 1
+
+
+class Pipeline:
+    '''
+    Runs stages in order over blocks of samples. block is the number of samples the preallocated
+    conversion buffer (see read_block()) holds.
+    '''
+    def __init__(self, *stages, block=32):
+        self.stages = stages
+        self.raw = array('h', bytes(6 * block))
+        self.buf = array('f', bytes(12 * block))
+        self.one = array('f', bytes(12))
+
+    def process(self, buf, count, start=0):
+        for stage in self.stages:
+            stage.process(buf, start, count)
+        return buf
+
+    def filter(self, x, y, z):
+        '''
+        Filters a single sample and returns the preallocated array('f') holding the result.
+        '''
+        one = self.one
+        one[0] = x
+        one[1] = y
+        one[2] = z
+        return self.process(one, 1)
+
+    def process_ring(self, ring, head):
+        '''
+        Filters the samples of a SampleRing from its tail up to head, in place.
+        '''
+        tail = ring.tail
+        if head < tail:
+            self.process(ring.xyz, ring.mask + 1 - tail, tail)
+            tail = 0
+        if head > tail:
+            self.process(ring.xyz, head - tail, tail)
+
+    def read_block(self, gyro):
+        '''
+        Drains the sensor FIFO with Gyro.read_block(), converts the samples to mdps and filters them.
+        Returns the number of samples, the block timestamp and the array('f') holding the samples,
+        ready for GyroMadgwick.update_block().
+        '''
+        count, ts = gyro.read_block(self.raw)
+        raw = self.raw
+        buf = self.buf
+        scale = gyro.mdps_per_lsb
+        for i in range(3 * count):
+            buf[i] = raw[i] * scale
+        return count, ts, self.process(buf, count)
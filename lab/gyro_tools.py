@@ -6,71 +6,223 @@
 # Released under the MIT License (MIT)
 # Copyright (c) 2017, 2018 Peter Hinch
 
-from math import sqrt, atan2, asin, degrees, radians
+import time
+from array import array
 
+import machine
+import micropython
 import stm32f429disc_gyro
 
-from lab.deltat import DeltaT
 from lab.device_tools import _getinstance
+from lab.fusion import GyroMadgwick, GyroBatch, Madgwick, Mahony, Complementary, check_kernel
 
 
 def get_gyro():
     return _getinstance(Gyro)
 
 
+# L3GD20 registers and bits used for FIFO access
+_CTRL_REG1 = const(0x20)
+_CTRL_REG3 = const(0x22)
+_CTRL_REG4 = const(0x23)
+_CTRL_REG5 = const(0x24)
+_STATUS_REG = const(0x27)
+_OUT_X_L = const(0x28)
+_FIFO_CTRL_REG = const(0x2E)
+_FIFO_SRC_REG = const(0x2F)
+_SPI_READ = const(0x80)
+_SPI_MULTI = const(0x40)
+_FIFO_EN = const(0x40)
+_FIFO_MODE_STREAM = const(0x40)
+_FIFO_FSS_MASK = const(0x1F)
+_FIFO_OVRN = const(0x40)
+_FIFO_EMPTY = const(0x20)
+_FIFO_DEPTH = const(32)
+_I2_DRDY = const(0x08)
+_ZYXOR = const(0x80)
+
+# Output data rates selectable in CTRL_REG1 (DR bits) and sensitivity per full scale setting (FS bits of CTRL_REG4)
+_ODR_HZ = (95, 190, 380, 760)
+_FS_MDPS_PER_LSB = (8.75, 17.5, 70.0, 70.0)
+
+
+class SampleRing:
+    '''
+    Preallocated single producer/single consumer ring buffer of timestamped x, y, z samples.
+    size must be a power of two. When the ring is full new samples are dropped and counted.
+    '''
+    __slots__ = ('ts', 'xyz', 'mask', 'head', 'tail', 'dropped')
+
+    def __init__(self, size=64):
+        self.ts = array('i', bytes(4 * size))
+        self.xyz = array('f', bytes(12 * size))
+        self.mask = size - 1
+        self.head = 0                       # next slot written by the producer
+        self.tail = 0                       # next slot read by the consumer
+        self.dropped = 0
+
+    def __len__(self):
+        return (self.head - self.tail) & self.mask
+
+    def push(self, ts, x, y, z):
+        head = self.head
+        nxt = (head + 1) & self.mask
+        if nxt == self.tail:
+            self.dropped += 1
+            return
+        self.ts[head] = ts
+        i = 3 * head
+        xyz = self.xyz
+        xyz[i] = x
+        xyz[i + 1] = y
+        xyz[i + 2] = z
+        self.head = nxt
+
+
 class Gyro:
     '''
     Simple wrapper class for the low level gyro driver module
+    read_block() drains the sensor's hardware FIFO in one SPI transfer. The driver module only offers
+    single samples, so the FIFO registers are accessed directly on SPI5 (chip select on PC1), using the
+    configuration left behind by stm32f429disc_gyro.init().
+    enable_irq() switches to interrupt driven sampling on the data ready line (INT2 on PA2).
     '''
     def __init__(self):
         stm32f429disc_gyro.init()
+        self.spi = None
+        self.odr = None
+        self.mdps_per_lsb = None
+        self.overruns = 0
+        self.ring = None
+        self.flag = None                    # Optional uasyncio.ThreadSafeFlag set when a sample arrives
+        self.fifo = False                   # Whether the sensor FIFO is in stream mode
 
     def read_xyz(self):
         return stm32f429disc_gyro.read_xyz()
 
+    def _init_spi(self):
+        if self.spi is not None:
+            return
+        self.cs = machine.Pin('PC1', machine.Pin.OUT, value=1)
+        self.spi = machine.SPI(5, baudrate=5000000, polarity=0, phase=0)
+        self._cmd = bytearray(1)
+        self._reg = bytearray(1)
+        # One FIFO sample is 6 bytes, reads roll over from OUT_Z_H to OUT_X_L while the FIFO is enabled
+        self._block_cmd = bytearray((_OUT_X_L | _SPI_READ | _SPI_MULTI,))
+        ctrl1 = self._read_reg(_CTRL_REG1)
+        self.odr = _ODR_HZ[ctrl1 >> 6]
+        self.mdps_per_lsb = _FS_MDPS_PER_LSB[(self._read_reg(_CTRL_REG4) >> 4) & 0x03]
 
-class GyroMadgwick:
-    '''
-    Class provides sensor fusion allowing heading, pitch and roll to be extracted. This uses the Madgwick algorithm.
-    The update method must be called peiodically. The calculations take 1.6mS on the Pyboard.
-    '''
-    declination = 0                         # Optional offset for true north. A +ve value adds to heading
-    def __init__(self):
-        self.deltat = DeltaT(None)          # Time between updates
-        self.q = [1.0, 0.0, 0.0, 0.0]       # vector to hold quaternion
-        self.pitch = 0
-        self.heading = 0
-        self.roll = 0
-
-    def update(self, gyro_dps):
-        gx, gy, gz = (radians(v) for v in gyro_dps) # Units deg/s
-        q1, q2, q3, q4 = (self.q[i] for i in range(4))   # short name local variable for readability
-
-        # Compute rate of change of quaternion
-        qDot1 = 0.5 * (-q2 * gx - q3 * gy - q4 * gz) # - self.beta * s1
-        qDot2 = 0.5 * (q1 * gx + q3 * gz - q4 * gy) # - self.beta * s2
-        qDot3 = 0.5 * (q1 * gy - q2 * gz + q4 * gx) # - self.beta * s3
-        qDot4 = 0.5 * (q1 * gz + q2 * gy - q3 * gx) # - self.beta * s4
-
-        # Integrate to yield quaternion
-        deltat = self.deltat(None)
-        q1 += qDot1 * deltat
-        q2 += qDot2 * deltat
-        q3 += qDot3 * deltat
-        q4 += qDot4 * deltat
-        norm = 1 / sqrt(q1 * q1 + q2 * q2 + q3 * q3 + q4 * q4)    # normalise quaternion
-        self.q = q1 * norm, q2 * norm, q3 * norm, q4 * norm
-        self.heading = 0
-        self.pitch = degrees(-asin(2.0 * (self.q[1] * self.q[3] - self.q[0] * self.q[2])))
-        self.roll = degrees(atan2(2.0 * (self.q[0] * self.q[1] + self.q[2] * self.q[3]),
-            self.q[0] * self.q[0] - self.q[1] * self.q[1] - self.q[2] * self.q[2] + self.q[3] * self.q[3]))
-
-    def run(self, gyro_obj=None, iterations=0, infinite=True):
-        if gyro_obj is None:
-            gyro_obj = get_gyro()
-        while infinite or iterations > 0:
-            gyro_mdps = (v / 1000.0 for v in gyro_obj.read_xyz())
-            self.update(gyro_mdps)
-            if not infinite:
-                iterations -= 1
-            yield self.pitch, self.roll
+    def read_config(self):
+        '''
+        Returns the output data rate in Hz and the sensitivity in mdps per LSB configured in the sensor.
+        '''
+        self._init_spi()
+        return self.odr, self.mdps_per_lsb
+
+    def set_odr(self, odr):
+        '''
+        Selects one of the output data rates 95, 190, 380 or 760 Hz.
+        '''
+        self._init_spi()
+        ctrl1 = self._read_reg(_CTRL_REG1)
+        self._write_reg(_CTRL_REG1, (ctrl1 & 0x3F) | (_ODR_HZ.index(odr) << 6))
+        self.odr = odr
+
+    def enable_fifo(self, odr=None):
+        '''
+        Switches the sensor FIFO to stream mode. odr selects the output data rate (see set_odr()),
+        None keeps the rate set by the driver.
+        '''
+        self._init_spi()
+        if odr is not None:
+            self.set_odr(odr)
+        self._write_reg(_FIFO_CTRL_REG, _FIFO_MODE_STREAM)
+        self._write_reg(_CTRL_REG5, self._read_reg(_CTRL_REG5) | _FIFO_EN)
+        self.fifo = True
+
+    def disable_fifo(self):
+        self._write_reg(_CTRL_REG5, self._read_reg(_CTRL_REG5) & ~_FIFO_EN)
+        self._write_reg(_FIFO_CTRL_REG, 0)
+        self.fifo = False
+
+    def enable_irq(self, size=64, odr=None):
+        '''
+        Samples on the data ready interrupt. The interrupt handler only records ticks_us(), the sample
+        is read in a callback run via micropython.schedule() and pushed together with the timestamp
+        into the preallocated SampleRing self.ring. Consume it with GyroMadgwick.update_ring().
+        Samples the sensor overwrote before they were read are counted in overruns.
+        '''
+        self._init_spi()
+        if odr is not None:
+            self.set_odr(odr)
+        self.ring = SampleRing(size)
+        self._irq_ts = 0
+        self._pending = False
+        self._read_ref = self._read_scheduled   # bound method allocated once, not in the ISR
+        self.drdy = machine.Pin('PA2', machine.Pin.IN)
+        self.drdy.irq(trigger=machine.Pin.IRQ_RISING, handler=self._isr, hard=True)
+        self._write_reg(_CTRL_REG3, self._read_reg(_CTRL_REG3) | _I2_DRDY)
+        # Data ready stays high until the sample is read, so discard one sample to get the first edge
+        stm32f429disc_gyro.read_xyz()
+
+    def disable_irq(self):
+        self._write_reg(_CTRL_REG3, self._read_reg(_CTRL_REG3) & ~_I2_DRDY)
+        self.drdy.irq(handler=None)
+
+    def _isr(self, pin):
+        # The scheduled read gets the newest sample, so keep the newest timestamp
+        self._irq_ts = time.ticks_us()
+        if not self._pending:
+            self._pending = True
+            micropython.schedule(self._read_ref, None)
+
+    def _read_scheduled(self, _):
+        self._pending = False
+        # Data ready stays high until the sample is read, so a late read raises no further edge; the
+        # sensor flags the overwritten sample instead (cleared by reading the data)
+        if self._read_reg(_STATUS_REG) & _ZYXOR:
+            self.overruns += 1
+        x, y, z = stm32f429disc_gyro.read_xyz()
+        self.ring.push(self._irq_ts, x, y, z)
+        if self.flag is not None:
+            self.flag.set()
+
+    def read_block(self, buf):
+        '''
+        Drains all pending samples from the hardware FIFO into buf, which must be an array('h')
+        holding x, y, z triples in raw counts (multiply by mdps_per_lsb for mdps).
+        Returns the number of samples read and the ticks_us() timestamp of the read.
+        At most len(buf) // 3 samples are read; the rest stays in the FIFO for the next call.
+        '''
+        if not self.fifo:
+            self.enable_fifo()
+        ts = time.ticks_us()
+        src = self._read_reg(_FIFO_SRC_REG)
+        if src & _FIFO_OVRN:
+            self.overruns += 1
+        count = 0 if src & _FIFO_EMPTY else (src & _FIFO_FSS_MASK) or _FIFO_DEPTH
+        count = min(count, len(buf) // 3)
+        if count:
+            self.cs(0)
+            self.spi.write(self._block_cmd)
+            # The sensor and the MCU are both little endian, so the samples land in buf unchanged
+            self.spi.readinto(memoryview(buf)[:3 * count])
+            self.cs(1)
+        return count, ts
+
+    def _read_reg(self, reg):
+        self._cmd[0] = reg | _SPI_READ
+        self.cs(0)
+        self.spi.write(self._cmd)
+        self.spi.readinto(self._reg)
+        self.cs(1)
+        return self._reg[0]
+
+    def _write_reg(self, reg, value):
+        self._cmd[0] = reg
+        self._reg[0] = value
+        self.cs(0)
+        self.spi.write(self._cmd)
+        self.spi.write(self._reg)
+        self.cs(1)
@@ -0,0 +1,113 @@
+# Compact binary gyro traces, for recording what Gyro produced on the board and
+# replaying it through the fusion offline (see tools/gyro_replay.py).
+#
+# File layout, little endian:
+#   header  '<4sBBHf'  magic b'GTRC', version, reserved, output data rate in Hz (0 if unknown),
+#                      mdps per LSB of the samples
+#   records '<Ihhh'    ticks_us() timestamp, x, y, z in raw counts
+#
+# Timestamps are ticks_us() values and wrap around like them (at 2**30 on
+# MicroPython), use ticks_diff() style arithmetic when differencing.
+
+import struct
+
+MAGIC = b'GTRC'
+VERSION = 1
+HEADER = '<4sBBHf'
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD = '<Ihhh'
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+class TraceWriter:
+    '''
+    Writes a trace to the stream f. Records are packed into a preallocated buffer of buffer_records
+    records, which is written out whenever it is full (and by flush()/close()).
+    '''
+    def __init__(self, f, mdps_per_lsb=1.0, odr=0, buffer_records=64):
+        self.f = f
+        self.mdps_per_lsb = mdps_per_lsb
+        self.buf = bytearray(buffer_records * RECORD_SIZE)
+        self.pos = 0
+        self.count = 0
+        f.write(struct.pack(HEADER, MAGIC, VERSION, 0, odr, mdps_per_lsb))
+
+    def write(self, ts, x, y, z):
+        struct.pack_into(RECORD, self.buf, self.pos, ts, x, y, z)
+        self.pos += RECORD_SIZE
+        self.count += 1
+        if self.pos == len(self.buf):
+            self.flush()
+
+    def write_mdps(self, ts, x, y, z):
+        # Converts mdps (e.g. from Gyro.read_xyz()) to counts, saturating at the int16 range
+        scale = 1 / self.mdps_per_lsb
+        self.write(ts, _clamp16(round(x * scale)), _clamp16(round(y * scale)), _clamp16(round(z * scale)))
+
+    def flush(self):
+        if self.pos:
+            self.f.write(memoryview(self.buf)[:self.pos])
+            self.pos = 0
+
+    def close(self):
+        self.flush()
+        self.f.close()
+
+
+def _clamp16(v):
+    return -32768 if v < -32768 else 32767 if v > 32767 else v
+
+
+def read_header(f):
+    '''
+    Returns odr and mdps_per_lsb of the trace in stream f, which is left positioned at the first record.
+    '''
+    magic, version, _, odr, mdps_per_lsb = struct.unpack(HEADER, f.read(HEADER_SIZE))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a gyro trace')
+    return odr, mdps_per_lsb
+
+
+def read_records(f):
+    '''
+    Yields (ts, x, y, z) for all records following the header in stream f.
+    '''
+    while True:
+        rec = f.read(RECORD_SIZE)
+        if len(rec) < RECORD_SIZE:
+            return
+        yield struct.unpack(RECORD, rec)
+
+
+def record(path, samples, gyro=None, fifo=False):
+    '''
+    Records samples gyro samples to the file path on the board. With fifo the sensor FIFO is drained in
+    blocks (see Gyro.read_block()) and the sample timestamps are derived from the block timestamp and the
+    output data rate, otherwise Gyro.read_xyz() is polled and every sample gets its own ticks_us().
+    '''
+    import time
+    from array import array
+    from lab import gyro_tools
+
+    if gyro is None:
+        gyro = gyro_tools.get_gyro()
+    with open(path, 'wb') as f:
+        if fifo:
+            gyro.enable_fifo()
+            period = 1000000 // gyro.odr
+            writer = TraceWriter(f, gyro.mdps_per_lsb, gyro.odr)
+            buf = array('h', bytes(6 * 32))
+            while writer.count < samples:
+                n, ts = gyro.read_block(buf)
+                for i in range(n):
+                    # The last sample of the block is the most recent one
+                    sample_ts = time.ticks_add(ts, (i - n + 1) * period)
+                    writer.write(sample_ts, buf[3 * i], buf[3 * i + 1], buf[3 * i + 2])
+        else:
+            odr, mdps_per_lsb = gyro.read_config()
+            writer = TraceWriter(f, mdps_per_lsb, odr)
+            while writer.count < samples:
+                x, y, z = gyro.read_xyz()
+                writer.write_mdps(time.ticks_us(), x, y, z)
+        writer.flush()
+    return writer.count
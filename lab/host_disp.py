@@ -0,0 +1,216 @@
+# Headless stand-in for the stm32f429disc_disp driver module, for running and
+# benchmarking the LVGL code on a host (e.g. the unix MicroPython port).
+# lab.display_tools falls back to this module if the driver is not available.
+#
+# Frames are rendered into an in-memory RGB565 framebuffer which can be hashed
+# and dumped as PPM or PNG. flush() calls, areas and bytes are counted, and
+# touch input can be replayed from a script:
+#
+#   host_disp.play_touch([(120, 160, True, 3), (120, 160, False, 1)])
+#
+# Every script step is (x, y, pressed, reads): the touch state reported for
+# that many ts_read() calls, in touch coordinates (see ts_calibrate()).
+
+import binascii
+import struct
+
+_width = 240
+_height = 320
+_fb = None
+_color_size = 2
+_calibration = None
+_touch_script = []
+_touch_step = 0
+_touch_reads = 0
+_last_touch = (0, 0)
+
+flush_count = 0
+flush_pixels = 0
+flush_bytes = 0
+frame_count = 0
+areas = []
+MAX_AREAS = 256             # Number of most recent flush areas kept in areas
+
+
+def init(width=240, height=320):
+    global _width, _height, _fb, _color_size
+    _width = width
+    _height = height
+    _fb = bytearray(width * height * 2)
+    try:
+        import lvgl as lv
+        _color_size = lv.color_t.__SIZE__
+    except ImportError:
+        _color_size = 2
+    reset_stats()
+
+
+def deinit():
+    global _fb
+    _fb = None
+
+
+def lcd_width():
+    return _width
+
+
+def lcd_height():
+    return _height
+
+
+def framebuffer():
+    return _fb
+
+
+def reset_stats():
+    global flush_count, flush_pixels, flush_bytes, frame_count
+    flush_count = 0
+    flush_pixels = 0
+    flush_bytes = 0
+    frame_count = 0
+    areas.clear()
+
+
+def stats():
+    return {'flushes': flush_count, 'frames': frame_count, 'pixels': flush_pixels, 'bytes': flush_bytes}
+
+
+def flush(disp_drv, area, color_p):
+    global flush_count, flush_pixels, flush_bytes, frame_count
+    x1 = area.x1
+    y1 = area.y1
+    w = area.x2 - x1 + 1
+    h = area.y2 - y1 + 1
+    size = w * h * _color_size
+    src = color_p.__dereference__(size)
+    if _color_size == 2:
+        row = 2 * w
+        for y in range(h):
+            pos = 2 * ((y1 + y) * _width + x1)
+            _fb[pos:pos + row] = src[y * row:(y + 1) * row]
+    else:
+        # 32 bit colour (BGRA), converted to RGB565
+        i = 0
+        for y in range(h):
+            pos = 2 * ((y1 + y) * _width + x1)
+            for _ in range(w):
+                c = ((src[i + 2] & 0xF8) << 8) | ((src[i + 1] & 0xFC) << 3) | (src[i] >> 3)
+                _fb[pos] = c & 0xFF
+                _fb[pos + 1] = c >> 8
+                pos += 2
+                i += 4
+
+    flush_count += 1
+    flush_pixels += w * h
+    flush_bytes += size
+    if len(areas) >= MAX_AREAS:
+        areas.pop(0)
+    areas.append((x1, y1, area.x2, area.y2))
+    if disp_drv.flush_is_last():
+        frame_count += 1
+    disp_drv.flush_ready()
+
+
+def ts_calibrate(x1, y1, x2, y2):
+    global _calibration
+    _calibration = (x1, y1, x2, y2)
+
+
+def play_touch(script):
+    global _touch_script, _touch_step, _touch_reads
+    _touch_script = list(script)
+    _touch_step = 0
+    _touch_reads = 0
+
+
+def ts_read(indev_drv, data):
+    global _touch_step, _touch_reads, _last_touch
+    import lvgl as lv
+    pressed = False
+    if _touch_step < len(_touch_script):
+        x, y, pressed, reads = _touch_script[_touch_step]
+        if _calibration is not None:
+            cx1, cy1, cx2, cy2 = _calibration
+            x = (x - cx1) * _width // (cx2 - cx1)
+            y = (y - cy1) * _height // (cy2 - cy1)
+        _last_touch = (min(max(x, 0), _width - 1), min(max(y, 0), _height - 1))
+        _touch_reads += 1
+        if _touch_reads >= reads:
+            _touch_step += 1
+            _touch_reads = 0
+    data.point.x, data.point.y = _last_touch
+    data.state = lv.INDEV_STATE.PRESSED if pressed else lv.INDEV_STATE.RELEASED
+    return False
+
+
+def frame_hash():
+    return binascii.crc32(_fb)
+
+
+def _rgb888_rows():
+    # Yields the framebuffer one RGB888 row at a time
+    row = bytearray(3 * _width)
+    for y in range(_height):
+        pos = 2 * y * _width
+        for x in range(_width):
+            c = _fb[pos] | (_fb[pos + 1] << 8)
+            r = (c >> 11) & 0x1F
+            g = (c >> 5) & 0x3F
+            b = c & 0x1F
+            row[3 * x] = (r << 3) | (r >> 2)
+            row[3 * x + 1] = (g << 2) | (g >> 4)
+            row[3 * x + 2] = (b << 3) | (b >> 2)
+            pos += 2
+        yield row
+
+
+def dump_ppm(path):
+    with open(path, 'wb') as f:
+        f.write(b'P6\n%d %d\n255\n' % (_width, _height))
+        for row in _rgb888_rows():
+            f.write(row)
+
+
+def _png_chunk(f, kind, data):
+    f.write(struct.pack('>I', len(data)))
+    f.write(kind)
+    f.write(data)
+    f.write(struct.pack('>I', binascii.crc32(data, binascii.crc32(kind)) & 0xFFFFFFFF))
+
+
+def _zlib_stored(raw):
+    # zlib stream with uncompressed deflate blocks, for ports without a compressor
+    out = bytearray(b'\x78\x01')
+    pos = 0
+    while True:
+        block = raw[pos:pos + 65535]
+        pos += len(block)
+        final = 1 if pos >= len(raw) else 0
+        out += struct.pack('<BHH', final, len(block), len(block) ^ 0xFFFF)
+        out += block
+        if final:
+            break
+    a = 1
+    b = 0
+    for c in raw:
+        a = (a + c) % 65521
+        b = (b + a) % 65521
+    out += struct.pack('>I', (b << 16) | a)
+    return out
+
+
+def dump_png(path):
+    raw = bytearray()
+    for row in _rgb888_rows():
+        raw.append(0)           # filter type None
+        raw += row
+    try:
+        import zlib
+        data = zlib.compress(raw)
+    except (ImportError, AttributeError):
+        data = _zlib_stored(raw)
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        _png_chunk(f, b'IHDR', struct.pack('>IIBBBBB', _width, _height, 8, 2, 0, 0, 0))
+        _png_chunk(f, b'IDAT', data)
+        _png_chunk(f, b'IEND', b'')
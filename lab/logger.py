@@ -0,0 +1,176 @@
+# Buffered, non-blocking data logger for flash or SD card.
+#
+# The producer (e.g. the sampling loop) packs records with struct into one of
+# two preallocated buffers and never touches the file system. Full buffers are
+# written out by flush(), called from a low priority task (see task()) or
+# whenever the application has time. If both buffers are full the record is
+# dropped and counted instead of blocking the producer.
+#
+# File layout: fixed size records '<BIfff', little endian:
+#   type, ticks_us() timestamp, three values
+#   REC_GYRO      x, y, z in mdps
+#   REC_ATTITUDE  pitch, roll, heading in degrees
+
+import os
+import struct
+
+REC_GYRO = 1
+REC_ATTITUDE = 2
+
+RECORD = '<BIfff'
+RECORD_SIZE = struct.calcsize(RECORD)
+
+
+class DataLogger:
+    '''
+    Logs to files named prefix + '_000.bin', '_001.bin', ..., continuing after existing files. Files are
+    rotated after max_file_bytes; with max_files only that many newest files are kept. os.sync() is called
+    after every sync_every buffers written, batching the flash writes.
+    '''
+    def __init__(self, prefix='log', buffer_records=256, max_file_bytes=1024 * 1024, max_files=None,
+                 sync_every=4):
+        self.prefix = prefix
+        size = buffer_records * RECORD_SIZE
+        self.bufs = (bytearray(size), bytearray(size))
+        self.active = 0                 # Buffer the producer writes to
+        self.pos = 0                    # Write position in the active buffer
+        self.full = None                # Index of the buffer waiting to be written, if any
+        self.max_file_bytes = max_file_bytes
+        self.max_files = max_files
+        self.sync_every = sync_every
+        self.dropped = 0
+        self.records = 0
+        self.file_index = -1
+        self.file = None
+        self.file_bytes = 0
+        self.unsynced = 0
+
+    def log(self, rec_type, ts, a, b, c):
+        if self.pos == len(self.bufs[self.active]) and not self._swap():
+            # Both buffers full: drop instead of waiting for the file system
+            self.dropped += 1
+            return False
+        struct.pack_into(RECORD, self.bufs[self.active], self.pos, rec_type, ts, a, b, c)
+        self.pos += RECORD_SIZE
+        self.records += 1
+        if self.pos == len(self.bufs[self.active]):
+            # Hand the buffer to flush() right away instead of on the next record
+            self._swap()
+        return True
+
+    def _swap(self):
+        if self.full is not None:
+            return False
+        self.full = self.active
+        self.active ^= 1
+        self.pos = 0
+        return True
+
+    def log_gyro(self, ts, x, y, z):
+        return self.log(REC_GYRO, ts, x, y, z)
+
+    def log_attitude(self, ts, pitch, roll, heading=0):
+        return self.log(REC_ATTITUDE, ts, pitch, roll, heading)
+
+    def flush(self, partial=False):
+        '''
+        Writes the full buffer, if any, to the file. With partial the records collected in the active
+        buffer are written as well. Returns the number of bytes written.
+        '''
+        written = 0
+        if self.full is not None:
+            buf = self.bufs[self.full]
+            self._write(buf)
+            written += len(buf)
+            self.full = None
+        if partial and self.pos:
+            self._write(memoryview(self.bufs[self.active])[:self.pos])
+            written += self.pos
+            self.pos = 0
+        if written:
+            self.unsynced += 1
+            if self.unsynced >= self.sync_every or partial:
+                self._sync()
+        return written
+
+    def close(self):
+        self.flush(partial=True)
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self._sync()
+
+    def task(self, period_us=100000):
+        '''
+        Returns a pyRTOS task function flushing the logger every period_us. Give it a low priority.
+        '''
+        from lab.pyrtos_tools import periodic
+        logger = self
+
+        # self is the thread object this runs in
+        @periodic(period_us)
+        def logger_task(self):
+            logger.flush()
+
+        return logger_task
+
+    def filename(self, index):
+        return '%s_%03d.bin' % (self.prefix, index)
+
+    def _write(self, data):
+        if self.file is None or self.file_bytes + len(data) > self.max_file_bytes:
+            self._rotate()
+        self.file.write(data)
+        self.file_bytes += len(data)
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        if self.file_index < 0:
+            # Continue after the files of earlier runs instead of overwriting them
+            self.file_index = self._next_index()
+        else:
+            self.file_index += 1
+        self.file = open(self.filename(self.file_index), 'wb')
+        self.file_bytes = 0
+        if self.max_files is not None:
+            # Prune by listing the directory, so files of earlier runs and gaps in the numbering count too
+            for index in sorted(self._indices())[:-self.max_files]:
+                try:
+                    os.remove(self.filename(index))
+                except OSError:
+                    pass
+
+    def _indices(self):
+        # Indices of the existing log files of this prefix
+        directory, _, name = self.prefix.rpartition('/')
+        start = name + '_'
+        indices = []
+        for entry in os.listdir(directory) if directory else os.listdir():
+            if entry.startswith(start) and entry.endswith('.bin'):
+                try:
+                    indices.append(int(entry[len(start):-4]))
+                except ValueError:
+                    pass
+        return indices
+
+    def _next_index(self):
+        indices = self._indices()
+        return max(indices) + 1 if indices else 0
+
+    def _sync(self):
+        self.unsynced = 0
+        if hasattr(os, 'sync'):
+            os.sync()
+
+
+def read_records(path):
+    '''
+    Yields (type, ts, a, b, c) for all records in the log file path.
+    '''
+    with open(path, 'rb') as f:
+        while True:
+            rec = f.read(RECORD_SIZE)
+            if len(rec) < RECORD_SIZE:
+                return
+            yield struct.unpack(RECORD, rec)
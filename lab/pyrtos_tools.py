@@ -1,42 +1,410 @@
 import sys
+import time
+from array import array
 
 import pyRTOS
-import lvgl as lv
 
+from lab.refresh import DISPLAY_FREQ, DISPLAY_FREQ_MIN, LV_NO_TIMER_READY, refresh_period_us, refresh_periods_us
 
-DISPLAY_FREQ = 25
 
+# Set to True before the tasks are created to let profiled() instrument them
+PROFILE = False
 
-# self is the thread object this runs in
-def display_event_loop(self):
-    ### Setup code here
-    if not lv.is_initialized():
-        lv.init()
-    # ns <-- us <-- ms <-- s
-    delay_ns = 1000 * 1000 * 1000 * 1.0 / DISPLAY_FREQ
-    ### End Setup code
+# Wake-up time requested by the running task through until_us(), timeout() or timeout_ns()
+_wake_deadline = None
 
-    # Pass control back to RTOS
-    yield
+# Common time origin of all Periodic timers, set by the first wait()
+_epoch = None
+# Age in μs after which a timer moves the epoch forward, well within ticks_diff() range (2**29 μs on the board)
+_EPOCH_MAX_AGE = 1 << 27
 
-    # Thread loop
-    while True:
-        ### Work code here
-        # If there is significant code here, yield periodically
-        # between instructions that are not timing dependent.
-        # Also, it is generally a good idea to yield after
-        # I/O commands that return instantly but will require
-        # some time to complete (like I2C data requests).
-        # Each task must yield at least one per iteration,
-        # or it will hog all of the CPU, preventing any other
-        # task from running.
-        try:
-            lv.task_handler()
-        except Exception as e:
-            sys.print_exception(e)
-        ### End Work code
+_time = time
 
-        yield [pyRTOS.timeout_ns(delay_ns)]
+
+def set_clock(clock=None):
+    '''
+    Runs the helpers in this module against clock (e.g. lab.vclock.VirtualClock, anything providing
+    ticks_us(), ticks_ms(), ticks_diff() and ticks_add()) instead of the time module. None restores it.
+    '''
+    global time, _epoch
+    time = _time if clock is None else clock
+    _epoch = None
+
+
+class Deadline:
+    '''
+    Blocking condition which unblocks the task once ticks_us() has reached the absolute deadline.
+    '''
+    __slots__ = ('deadline',)
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return time.ticks_diff(time.ticks_us(), self.deadline) >= 0
+
+
+def until_us(deadline):
+    global _wake_deadline
+    _wake_deadline = deadline
+    return Deadline(deadline)
+
+
+class Periodic:
+    '''
+    Reusable blocking condition for periodic tasks, scheduling wake-ups on an absolute ticks_us() timeline,
+    so the loop body run time does not accumulate. All timers share one epoch, set by the first wait() of
+    any of them, and wake up at epoch + phase_us + n * period_us: tasks with the same period and different
+    phases keep their offsets no matter when each starts. The first wake-up is at most one period away.
+    The timers move the epoch forward by whole periods of their own to keep it within ticks_diff() range,
+    so tasks with different periods stay aligned if the periods are multiples of each other.
+    When a wake-up is already due at the time wait() is called, the overrun is counted. With catch_up the
+    missed periods then run back to back, otherwise they are skipped (counted in skipped).
+
+        timer = Periodic(1000)
+        while True:
+            ...
+            yield [timer.wait()]
+    '''
+    __slots__ = ('period', 'phase', 'catch_up', 'deadline', 'overruns', 'skipped')
+
+    def __init__(self, period_us, phase_us=0, catch_up=False):
+        self.period = period_us
+        self.phase = phase_us
+        self.catch_up = catch_up
+        self.deadline = None
+        self.overruns = 0
+        self.skipped = 0
+
+    def wait(self):
+        global _wake_deadline, _epoch
+        if self.deadline is None:
+            now = time.ticks_us()
+            if _epoch is None:
+                _epoch = now
+            # Next slot of this timer on the shared timeline
+            deadline = time.ticks_add(now, (self.phase - time.ticks_diff(now, _epoch)) % self.period)
+            _epoch = time.ticks_add(deadline, -self.phase)
+        else:
+            deadline = time.ticks_add(self.deadline, self.period)
+            late = time.ticks_diff(time.ticks_us(), deadline)
+            if late > 0:
+                self.overruns += 1
+                if not self.catch_up:
+                    missed = late // self.period + 1
+                    self.skipped += missed
+                    deadline = time.ticks_add(deadline, missed * self.period)
+            if time.ticks_diff(deadline, _epoch) > _EPOCH_MAX_AGE:
+                _epoch = time.ticks_add(deadline, -self.phase)
+        self.deadline = deadline
+        _wake_deadline = deadline
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return time.ticks_diff(time.ticks_us(), self.deadline) >= 0
+
+
+# Periodic timers of the tasks created by periodic(), by task name
+periodic_timers = {}
+
+
+def periodic(period_us, phase_us=0, catch_up=False):
+    '''
+    Decorator turning body(self) into a task function calling it every period_us, see Periodic.
+    The task terminates when body returns False. Overruns are reported in periodic_timers[task name].
+
+        @periodic(1000)
+        def sample_task(self):
+            ...
+
+        pyRTOS.add_task(pyRTOS.Task(sample_task, name="sample"))
+    '''
+    def decorator(body):
+        # self is the thread object this runs in
+        def periodic_task(self):
+            timer = Periodic(period_us, phase_us, catch_up)
+            periodic_timers[self.name] = timer
+
+            # Pass control back to RTOS
+            yield
+
+            while True:
+                yield [timer.wait()]
+                if body(self) is False:
+                    return
+        return periodic_task
+    return decorator
+
+
+# Drop-in replacements for pyRTOS.timeout() and pyRTOS.timeout_ns() which let profiled() see the requested delay
+def timeout(seconds):
+    global _wake_deadline
+    _wake_deadline = time.ticks_add(time.ticks_us(), int(seconds * 1000000))
+    return pyRTOS.timeout(seconds)
+
+
+def timeout_ns(ns):
+    global _wake_deadline
+    _wake_deadline = time.ticks_add(time.ticks_us(), int(ns // 1000))
+    return pyRTOS.timeout_ns(ns)
+
+
+# Per task statistics collected by profiled(), by task name
+task_stats = {}
+
+HIST_BUCKETS = 16
+
+
+class TaskStats:
+    '''
+    Run time and wake-up latency statistics of one task, all times in μs.
+    hist[i] counts iterations with a run time below 2**i μs (the last bucket collects the rest).
+    A deadline miss is an iteration running longer than budget_us or waking up later than late_us.
+    '''
+    __slots__ = ('name', 'budget_us', 'late_us', 'runs', 'run_total', 'run_max',
+                 'wakes', 'latency_total', 'latency_max', 'misses', 'hist')
+
+    def __init__(self, name, budget_us=None, late_us=1000):
+        self.name = name
+        self.budget_us = budget_us
+        self.late_us = late_us
+        self.hist = array('I', bytes(4 * HIST_BUCKETS))
+        self.reset()
+
+    def reset(self):
+        self.runs = 0
+        self.run_total = 0
+        self.run_max = 0
+        self.wakes = 0
+        self.latency_total = 0
+        self.latency_max = 0
+        self.misses = 0
+        for i in range(HIST_BUCKETS):
+            self.hist[i] = 0
+
+    def add_run(self, us):
+        self.runs += 1
+        self.run_total += us
+        if us > self.run_max:
+            self.run_max = us
+        if self.budget_us is not None and us > self.budget_us:
+            self.misses += 1
+        bucket = 0
+        while us and bucket < HIST_BUCKETS - 1:
+            us >>= 1
+            bucket += 1
+        self.hist[bucket] += 1
+
+    def add_wake(self, latency_us):
+        self.wakes += 1
+        self.latency_total += latency_us
+        if latency_us > self.latency_max:
+            self.latency_max = latency_us
+        if latency_us > self.late_us:
+            self.misses += 1
+
+    def __repr__(self):
+        run_avg = self.run_total // self.runs if self.runs else 0
+        latency_avg = self.latency_total // self.wakes if self.wakes else 0
+        return f'{self.name}: runs={self.runs} run avg/max={run_avg}/{self.run_max}us ' \
+               f'latency avg/max={latency_avg}/{self.latency_max}us misses={self.misses}'
+
+
+def profiled(func, budget_us=None, late_us=1000):
+    '''
+    Wraps a task function to record per iteration run time and the wake-up latency versus the delay requested
+    with until_us(), timeout() or timeout_ns() from this module. Returns func unchanged unless PROFILE is set.
+    Usage: pyRTOS.Task(profiled(display_event_loop), name="display")
+    '''
+    if not PROFILE:
+        return func
+
+    # self is the thread object this runs in
+    def profiled_task(self):
+        global _wake_deadline
+        stats = TaskStats(self.name, budget_us, late_us)
+        task_stats[self.name] = stats
+        thread = func(self)
+        wake = None
+        while True:
+            start = time.ticks_us()
+            if wake is not None:
+                stats.add_wake(max(0, time.ticks_diff(start, wake)))
+            _wake_deadline = None
+            try:
+                blocks = next(thread)
+            except StopIteration:
+                return
+            stats.add_run(time.ticks_diff(time.ticks_us(), start))
+            wake = _wake_deadline
+            yield blocks
+
+    return profiled_task
+
+
+def dump_stats(reset=False):
+    for stats in task_stats.values():
+        print(stats)
+        print('  run time histogram (<2**i us):', list(stats.hist))
+        if reset:
+            stats.reset()
+
+
+class MessagePool:
+    '''
+    Fixed pool of recyclable pyRTOS.Message objects, so sending messages does not allocate.
+    Every message owns a payload slot of width items in one shared array('typecode'), available as
+    msg.message (a memoryview) to fill before sending. The receiver hands the message back with release().
+    Messages sent to tasks which do not exist are dropped by pyRTOS and never come back to the pool.
+    '''
+    def __init__(self, size, width=3, typecode='f'):
+        self.data = array(typecode, (0 for _ in range(size * width)))
+        payload = memoryview(self.data)
+        self.messages = [pyRTOS.Message(0, None, None, payload[i * width:(i + 1) * width]) for i in range(size)]
+        self.free = list(self.messages)
+        self.exhausted = 0
+
+    def acquire(self, type, source, target):
+        '''
+        Returns a free message with the given header, or None (counted in exhausted) if all are in use.
+        '''
+        if not self.free:
+            self.exhausted += 1
+            return None
+        msg = self.free.pop()
+        msg.type = type
+        msg.source = source
+        msg.target = target
+        return msg
+
+    def release(self, msg):
+        self.free.append(msg)
+
+
+class RingChannel:
+    '''
+    Single producer/single consumer ring of fixed width records in a preallocated array, for streaming
+    samples between tasks without pyRTOS messages. slots must be a power of two. When the ring is full
+    push() drops the record and counts it in dropped.
+
+    Producer:  channel.push3(x, y, z)
+    Consumer:  while channel.pop_into(sample): ...
+    '''
+    __slots__ = ('data', 'width', 'mask', 'head', 'tail', 'dropped')
+
+    def __init__(self, slots, width=3, typecode='f'):
+        self.data = array(typecode, (0 for _ in range(slots * width)))
+        self.width = width
+        self.mask = slots - 1
+        self.head = 0
+        self.tail = 0
+        self.dropped = 0
+
+    def __len__(self):
+        return (self.head - self.tail) & self.mask
+
+    def push(self, record):
+        head = self.head
+        nxt = (head + 1) & self.mask
+        if nxt == self.tail:
+            self.dropped += 1
+            return False
+        data = self.data
+        width = self.width
+        i = head * width
+        for j in range(width):
+            data[i + j] = record[j]
+        self.head = nxt
+        return True
+
+    def push3(self, a, b, c):
+        # Fast path for 3-axis samples (width 3), the producer does not have to build a record
+        head = self.head
+        nxt = (head + 1) & self.mask
+        if nxt == self.tail:
+            self.dropped += 1
+            return False
+        data = self.data
+        i = 3 * head
+        data[i] = a
+        data[i + 1] = b
+        data[i + 2] = c
+        self.head = nxt
+        return True
+
+    def pop_into(self, record):
+        '''
+        Copies the oldest record into record (e.g. an array of width items). Returns False if the ring is empty.
+        '''
+        tail = self.tail
+        if tail == self.head:
+            return False
+        data = self.data
+        width = self.width
+        i = tail * width
+        for j in range(width):
+            record[j] = data[i + j]
+        self.tail = (tail + 1) & self.mask
+        return True
+
+
+def make_display_event_loop(max_freq=DISPLAY_FREQ, min_freq=DISPLAY_FREQ_MIN):
+    '''
+    Returns a display task function refreshing at most max_freq and at least min_freq times per second.
+    In between, the task sleeps until the next LVGL timer is due. Wake-ups are scheduled on an absolute
+    timeline, so the run time of lv.task_handler() does not stretch the period.
+    '''
+    min_period_us, max_period_us = refresh_periods_us(max_freq, min_freq)
+
+    # self is the thread object this runs in
+    def display_event_loop(self):
+        ### Setup code here
+        import lvgl as lv
+        if not lv.is_initialized():
+            lv.init()
+        ### End Setup code
+
+        # Pass control back to RTOS
+        yield
+
+        deadline = time.ticks_us()
+        # Thread loop
+        while True:
+            ### Work code here
+            # If there is significant code here, yield periodically
+            # between instructions that are not timing dependent.
+            # Also, it is generally a good idea to yield after
+            # I/O commands that return instantly but will require
+            # some time to complete (like I2C data requests).
+            # Each task must yield at least one per iteration,
+            # or it will hog all of the CPU, preventing any other
+            # task from running.
+            try:
+                idle_ms = lv.task_handler()
+            except Exception as e:
+                sys.print_exception(e)
+                idle_ms = None
+            ### End Work code
+
+            # Sleep until the next LVGL timer is due, within the configured refresh rates
+            deadline = time.ticks_add(deadline, refresh_period_us(idle_ms, min_period_us, max_period_us))
+            now = time.ticks_us()
+            if time.ticks_diff(deadline, now) < 0:
+                # Running late, continue from now instead of catching up on missed refreshes
+                deadline = now
+
+            yield [until_us(deadline)]
+
+    return display_event_loop
+
+
+display_event_loop = make_display_event_loop()
 
 
 def main():
@@ -46,4 +414,4 @@ def main():
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,25 @@
+# Display refresh pacing shared by the pyRTOS (lab.pyrtos_tools) and uasyncio
+# (lab.uasyncio_tools) runtimes. Imports neither lvgl nor a scheduler.
+
+DISPLAY_FREQ = 25           # Maximum refresh rate
+DISPLAY_FREQ_MIN = 5        # Refresh rate while LVGL has nothing to do
+
+# lv.task_handler() returns this if no LVGL timer is ready
+LV_NO_TIMER_READY = 0xFFFFFFFF
+
+
+def refresh_periods_us(max_freq=DISPLAY_FREQ, min_freq=DISPLAY_FREQ_MIN):
+    '''
+    Returns the shortest and the longest refresh period in μs for the given refresh rates.
+    '''
+    return 1000000 // max_freq, 1000000 // min_freq
+
+
+def refresh_period_us(idle_ms, min_period_us, max_period_us):
+    '''
+    Returns the time in μs until the next refresh, given the return value of lv.task_handler()
+    (None if it failed): the time until the next LVGL timer is due, within the two periods.
+    '''
+    if idle_ms is None or idle_ms == LV_NO_TIMER_READY:
+        return max_period_us
+    return min(max(idle_ms * 1000, min_period_us), max_period_us)
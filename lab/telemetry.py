@@ -0,0 +1,179 @@
+# Compact binary telemetry, as a cheaper alternative to print() for getting
+# data off the board (see tools/telemetry_decode.py for the host side).
+#
+# Frame layout, little endian:
+#   0xA5 0x5A  sync
+#   type       u8, one of the T_* constants below
+#   seq        u8, incremented per frame, to detect lost frames
+#   length     u8, payload length
+#   payload    see PAYLOADS
+#   crc        u32, binascii.crc32() of type, seq, length and payload
+#
+# Frames are collected in a preallocated buffer and written to the stream in
+# batches. A receiver resynchronises on the sync bytes and the CRC, so text
+# output (e.g. from the REPL) on the same port only costs the frames it hits.
+
+import binascii
+import struct
+
+SYNC = b'\xA5\x5A'
+HEADER_SIZE = 5
+CRC_SIZE = 4
+
+T_ATTITUDE = 1          # ticks_us, pitch, roll
+T_QUATERNION = 2        # ticks_us, w, x, y, z
+T_GYRO = 3              # ticks_us, x, y, z in mdps
+T_TASK = 4              # name (8 bytes), runs, average run time, maximum run time, maximum latency, misses
+
+PAYLOADS = {
+    T_ATTITUDE: '<Iff',
+    T_QUATERNION: '<Iffff',
+    T_GYRO: '<Ifff',
+    T_TASK: '<8sIIIII',
+}
+
+_ATTITUDE_SIZE = struct.calcsize(PAYLOADS[T_ATTITUDE])
+_QUATERNION_SIZE = struct.calcsize(PAYLOADS[T_QUATERNION])
+_GYRO_SIZE = struct.calcsize(PAYLOADS[T_GYRO])
+_TASK_SIZE = struct.calcsize(PAYLOADS[T_TASK])
+
+
+def default_stream():
+    try:
+        import pyb
+        return pyb.USB_VCP()
+    except ImportError:
+        import sys
+        return sys.stdout.buffer
+
+
+class Telemetry:
+    '''
+    Encodes frames into a batch_bytes buffer and writes it to stream (by default the USB serial port)
+    when it is full or on flush().
+    '''
+    def __init__(self, stream=None, batch_bytes=512):
+        self.stream = default_stream() if stream is None else stream
+        self.buf = bytearray(batch_bytes)
+        self.mv = memoryview(self.buf)
+        self.pos = 0
+        self.seq = 0
+        self.frames = 0
+
+    def _begin(self, ftype, size):
+        if self.pos + HEADER_SIZE + size + CRC_SIZE > len(self.buf):
+            self.flush()
+        pos = self.pos
+        buf = self.buf
+        buf[pos] = 0xA5
+        buf[pos + 1] = 0x5A
+        buf[pos + 2] = ftype
+        buf[pos + 3] = self.seq
+        buf[pos + 4] = size
+        self.seq = (self.seq + 1) & 0xFF
+        return pos + HEADER_SIZE
+
+    def _end(self, end):
+        crc = binascii.crc32(self.mv[self.pos + 2:end])
+        struct.pack_into('<I', self.buf, end, crc & 0xFFFFFFFF)
+        self.pos = end + CRC_SIZE
+        self.frames += 1
+
+    def attitude(self, ts, pitch, roll):
+        pos = self._begin(T_ATTITUDE, _ATTITUDE_SIZE)
+        struct.pack_into(PAYLOADS[T_ATTITUDE], self.buf, pos, ts, pitch, roll)
+        self._end(pos + _ATTITUDE_SIZE)
+
+    def quaternion(self, ts, q):
+        pos = self._begin(T_QUATERNION, _QUATERNION_SIZE)
+        struct.pack_into(PAYLOADS[T_QUATERNION], self.buf, pos, ts, q[0], q[1], q[2], q[3])
+        self._end(pos + _QUATERNION_SIZE)
+
+    def gyro(self, ts, x, y, z):
+        pos = self._begin(T_GYRO, _GYRO_SIZE)
+        struct.pack_into(PAYLOADS[T_GYRO], self.buf, pos, ts, x, y, z)
+        self._end(pos + _GYRO_SIZE)
+
+    def task_stats(self, stats):
+        # stats is a pyrtos_tools.TaskStats
+        pos = self._begin(T_TASK, _TASK_SIZE)
+        run_avg = stats.run_total // stats.runs if stats.runs else 0
+        struct.pack_into(PAYLOADS[T_TASK], self.buf, pos, stats.name.encode()[:8], stats.runs, run_avg,
+                         stats.run_max, stats.latency_max, stats.misses)
+        self._end(pos + _TASK_SIZE)
+
+    def flush(self):
+        if self.pos:
+            self.stream.write(self.mv[:self.pos])
+            self.pos = 0
+
+    def task(self, period_us=20000, gm=None):
+        '''
+        Returns a pyRTOS task function which every period_us sends the attitude of the GyroMadgwick gm
+        (if given) and writes out the batch.
+        '''
+        import time
+        from lab.pyrtos_tools import periodic
+        telemetry = self
+
+        # self is the thread object this runs in
+        @periodic(period_us)
+        def telemetry_task(self):
+            if gm is not None:
+                ts = time.ticks_us()
+                telemetry.attitude(ts, gm.pitch, gm.roll)
+                telemetry.quaternion(ts, gm.q)
+            telemetry.flush()
+
+        return telemetry_task
+
+
+class Decoder:
+    '''
+    Incremental frame decoder. feed() takes arbitrary chunks of the byte stream and returns the list of
+    decoded frames as (type, seq, values). Damaged frames and bytes between frames are skipped and counted
+    in crc_errors and skipped, sequence gaps in lost.
+    '''
+    def __init__(self):
+        self.data = bytearray()
+        self.last_seq = None
+        self.crc_errors = 0
+        self.skipped = 0
+        self.lost = 0
+
+    def feed(self, chunk):
+        self.data += chunk
+        data = self.data
+        frames = []
+        pos = 0
+        while True:
+            start = data.find(SYNC, pos)
+            if start < 0:
+                # Keep a possible first sync byte at the end
+                keep = 1 if data[-1:] == SYNC[:1] else 0
+                self.skipped += len(data) - pos - keep
+                pos = len(data) - keep
+                break
+            self.skipped += start - pos
+            if start + HEADER_SIZE > len(data):
+                pos = start
+                break
+            ftype, seq, size = data[start + 2], data[start + 3], data[start + 4]
+            end = start + HEADER_SIZE + size
+            if end + CRC_SIZE > len(data):
+                pos = start
+                break
+            crc = struct.unpack_from('<I', data, end)[0]
+            fmt = PAYLOADS.get(ftype)
+            if crc != binascii.crc32(data[start + 2:end]) & 0xFFFFFFFF or fmt is None \
+                    or struct.calcsize(fmt) != size:
+                self.crc_errors += 1
+                pos = start + 1
+                continue
+            if self.last_seq is not None:
+                self.lost += (seq - self.last_seq - 1) & 0xFF
+            self.last_seq = seq
+            frames.append((ftype, seq, struct.unpack_from(fmt, data, start + HEADER_SIZE)))
+            pos = end + CRC_SIZE
+        del data[:pos]
+        return frames
@@ -0,0 +1,273 @@
+# Touch input pipeline and calibration for lab.display_tools.
+#
+# TouchPipeline sits between the driver's ts_read() and LVGL: every sample of a
+# touch goes into a small ring buffer, the median of the newest samples is
+# smoothed by an IIR filter, and press and release are debounced, so jitter and
+# short contact bounces do not reach the widgets as drags or extra clicks.
+# Samples can be taken from a machine.Timer more often than LVGL reads the
+# input (see start_sampling()); the default window and counts assume a sample
+# every few milliseconds, at the LVGL read period alone they add tens of
+# milliseconds. An LVGL timer would not do: it runs at most once per
+# lv.task_handler() call, and being always due it would keep the adaptive
+# display refresh of lab.pyrtos_tools and lab.uasyncio_tools at its maximum rate.
+#
+# The calibration is an affine map from touch to screen coordinates, fitted by
+# least squares to any number of points (fit_affine()), and persisted as JSON
+# so get_display() can load it at boot (save_calibration(), load_calibration()).
+
+from array import array
+
+CALIBRATION_FILE = 'touch_cal.json'
+IDENTITY = (1.0, 0.0, 0.0, 0.0, 1.0, 0.0)
+
+
+def select(values, n, k):
+    '''
+    Returns the k-th smallest of the first n items of values, which are reordered in place
+    (quickselect, O(n) on average).
+    '''
+    lo = 0
+    hi = n - 1
+    while lo < hi:
+        pivot = values[(lo + hi) >> 1]
+        i = lo
+        j = hi
+        while i <= j:
+            while values[i] < pivot:
+                i += 1
+            while values[j] > pivot:
+                j -= 1
+            if i <= j:
+                values[i], values[j] = values[j], values[i]
+                i += 1
+                j -= 1
+        if k <= j:
+            hi = j
+        elif k >= i:
+            lo = i
+        else:
+            break
+    return values[k]
+
+
+def median(values, n=None):
+    # Median (upper median for even n) of the first n items of values, reordering them
+    if n is None:
+        n = len(values)
+    return select(values, n, n >> 1)
+
+
+class TouchPipeline:
+    '''
+    Filters the driver function read (e.g. stm32f429disc_disp.ts_read) for an LVGL pointer device
+    of width x height pixels; register read_cb() as the indev read_cb.
+    window is the number of newest samples the median is taken over (at most size, a power of two),
+    alpha the IIR coefficient (1 disables smoothing). A touch is reported after press_count pressed
+    samples in a row, and released after release_count released ones.
+    indev_drv is the LVGL driver passed to read, needed to sample before LVGL first calls read_cb().
+    '''
+    def __init__(self, read, width, height, size=8, window=5, alpha=0.5, press_count=2, release_count=3,
+                 indev_drv=None):
+        import lvgl as lv
+        self._lv = lv
+        self._read = read
+        self._drv = indev_drv
+        self._data = lv.indev_data_t()
+        self.width = width
+        self.height = height
+        self.mask = size - 1
+        self.window = min(window, size)
+        self.alpha = alpha
+        self.press_count = press_count
+        self.release_count = release_count
+        self.xs = array('h', bytes(2 * size))
+        self.ys = array('h', bytes(2 * size))
+        self._scratch = array('h', bytes(2 * size))
+        self.head = 0
+        self.count = 0                      # Samples of the current touch in the ring, up to size
+        self.filtered = array('f', (0.0, 0.0))
+        self.affine = array('f', IDENTITY)
+        self.touching = False               # Debounced contact, including the release hold-off
+        self.pressed = False                # State reported to LVGL
+        self._presses = 0
+        self._releases = 0
+        self.x = 0
+        self.y = 0
+        self.samples = 0
+        self._timer = None
+        self._pending = False
+        self._schedule = None
+        self._sample_ref = self._sample_scheduled  # bound method allocated once, not in the timer callback
+
+    def set_affine(self, coefficients):
+        '''
+        Sets the calibration (a, b, c, d, e, f): screen x = a * x + b * y + c, y = d * x + e * y + f.
+        '''
+        for i in range(6):
+            self.affine[i] = coefficients[i]
+
+    def sample(self):
+        # Reads one sample from the driver into the ring and updates the filter and debounce state
+        data = self._data
+        self._read(self._drv, data)
+        self.samples += 1
+        if data.state == self._lv.INDEV_STATE.PRESSED:
+            self._releases = 0
+            if not self.touching:
+                # New touch: do not mix its samples with those of the previous one
+                self.touching = True
+                self.count = 0
+                self._presses = 0
+            head = self.head
+            self.xs[head] = data.point.x
+            self.ys[head] = data.point.y
+            self.head = (head + 1) & self.mask
+            if self.count <= self.mask:
+                self.count += 1
+            self._filter()
+            self._presses += 1
+            if self._presses >= self.press_count:
+                self.pressed = True
+        else:
+            self._presses = 0
+            if self.touching:
+                self._releases += 1
+                if self._releases >= self.release_count:
+                    self.touching = False
+                    self.pressed = False
+
+    def _filter(self):
+        n = min(self.count, self.window)
+        mask = self.mask
+        scratch = self._scratch
+        f = self.filtered
+        for axis in range(2):
+            src = self.ys if axis else self.xs
+            i = self.head
+            for j in range(n):
+                i = (i - 1) & mask
+                scratch[j] = src[i]
+            m = median(scratch, n)
+            if self.count == 1:
+                f[axis] = m
+            else:
+                f[axis] += self.alpha * (m - f[axis])
+
+    def read_cb(self, indev_drv, data):
+        self._drv = indev_drv
+        if self._timer is None:
+            # Otherwise only the timer samples, so the ring is never updated from two places at once
+            self.sample()
+        if self.pressed:
+            f = self.filtered
+            a = self.affine
+            x = int(a[0] * f[0] + a[1] * f[1] + a[2])
+            y = int(a[3] * f[0] + a[4] * f[1] + a[5])
+            self.x = 0 if x < 0 else self.width - 1 if x >= self.width else x
+            self.y = 0 if y < 0 else self.height - 1 if y >= self.height else y
+        data.point.x = self.x
+        data.point.y = self.y
+        data.state = self._lv.INDEV_STATE.PRESSED if self.pressed else self._lv.INDEV_STATE.RELEASED
+        return False
+
+    def start_sampling(self, period_ms=5):
+        '''
+        Samples every period_ms from a machine.Timer instead of on the reads of LVGL. The timer callback
+        only schedules sample() with micropython.schedule(), so the driver is read outside interrupt
+        context.
+        '''
+        import machine
+        import micropython
+        self.stop_sampling()
+        self._schedule = micropython.schedule
+        self._timer = machine.Timer(-1)
+        self._timer.init(mode=machine.Timer.PERIODIC, period=period_ms, callback=self._tick)
+
+    def stop_sampling(self):
+        if self._timer is not None:
+            self._timer.deinit()
+            self._timer = None
+
+    def _tick(self, timer):
+        # Skips the sample if the previous one has not run yet or there is no driver to pass to read
+        if not self._pending and self._drv is not None:
+            self._pending = True
+            self._schedule(self._sample_ref, None)
+
+    def _sample_scheduled(self, _):
+        self._pending = False
+        if self._timer is not None:
+            self.sample()
+
+
+def _solve3(m, v):
+    # Solves the 3 x 3 system m * x = v (m as 9 values, row by row) with Cramer's rule
+    def det(a):
+        return (a[0] * (a[4] * a[8] - a[5] * a[7]) - a[1] * (a[3] * a[8] - a[5] * a[6])
+                + a[2] * (a[3] * a[7] - a[4] * a[6]))
+    d = det(m)
+    if not d:
+        raise ValueError('Calibration points are collinear')
+    result = []
+    for col in range(3):
+        a = list(m)
+        a[col], a[3 + col], a[6 + col] = v
+        result.append(det(a) / d)
+    return result
+
+
+def fit_affine(screen_points, touch_points):
+    '''
+    Returns the affine calibration (a, b, c, d, e, f) mapping the touch coordinates to the screen
+    coordinates with the least squared error. Both are sequences of (x, y); at least three points,
+    not on a line, are needed.
+    '''
+    if len(touch_points) < 3 or len(touch_points) != len(screen_points):
+        raise ValueError('At least three point pairs are needed')
+    # Normal equations: sum of [tx, ty, 1]^T [tx, ty, 1] and of [tx, ty, 1]^T * screen x (y)
+    m = [0.0] * 9
+    vx = [0.0, 0.0, 0.0]
+    vy = [0.0, 0.0, 0.0]
+    for (sx, sy), (tx, ty) in zip(screen_points, touch_points):
+        row = (tx, ty, 1.0)
+        for i in range(3):
+            for j in range(3):
+                m[3 * i + j] += row[i] * row[j]
+            vx[i] += row[i] * sx
+            vy[i] += row[i] * sy
+    return tuple(_solve3(m, vx) + _solve3(m, vy))
+
+
+def save_calibration(values, path=CALIBRATION_FILE):
+    '''
+    Stores a calibration, 4 values for the driver's two point calibration (integers, as the driver takes
+    them) or 6 affine coefficients.
+    '''
+    import json
+    import os
+    if len(values) == 4:
+        values = [int(round(v)) for v in values]
+    else:
+        values = [float(v) for v in values]
+    with open(path, 'w') as f:
+        json.dump({'calibration': values}, f)
+    if hasattr(os, 'sync'):
+        os.sync()
+
+
+def load_calibration(path=CALIBRATION_FILE):
+    '''
+    Returns the calibration stored by save_calibration(), None if there is none or it is unreadable.
+    '''
+    import json
+    try:
+        with open(path) as f:
+            values = json.load(f)['calibration']
+        if len(values) == 4:
+            # The driver takes integers, also from files written with float values
+            return [int(round(v)) for v in values]
+        if len(values) == 6:
+            return [float(v) for v in values]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
@@ -0,0 +1,153 @@
+# uasyncio based runtime, an alternative to the pyRTOS tasks in lab.pyrtos_tools
+# for the same workload: display refresh, gyro sampling and message passing.
+
+import sys
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+try:
+    import utime as time
+except ImportError:
+    import time
+
+from lab.refresh import DISPLAY_FREQ, DISPLAY_FREQ_MIN, LV_NO_TIMER_READY, refresh_period_us, refresh_periods_us
+
+
+async def display_refresh(max_freq=DISPLAY_FREQ, min_freq=DISPLAY_FREQ_MIN):
+    '''
+    Display refresh coroutine, the uasyncio counterpart of pyrtos_tools.display_event_loop.
+    Sleeps until the next LVGL timer is due, within max_freq and min_freq refreshes per second,
+    on an absolute timeline so the handler run time does not stretch the period.
+    '''
+    import lvgl as lv
+    if not lv.is_initialized():
+        lv.init()
+    min_period_us, max_period_us = refresh_periods_us(max_freq, min_freq)
+    deadline = time.ticks_us()
+    while True:
+        try:
+            idle_ms = lv.task_handler()
+        except Exception as e:
+            sys.print_exception(e)
+            idle_ms = None
+        deadline = time.ticks_add(deadline, refresh_period_us(idle_ms, min_period_us, max_period_us))
+        delay_us = time.ticks_diff(deadline, time.ticks_us())
+        if delay_us < 0:
+            # Running late, continue from now instead of catching up on missed refreshes
+            deadline = time.ticks_us()
+            delay_us = 0
+        await asyncio.sleep_ms(delay_us // 1000)
+
+
+class GyroStream:
+    '''
+    Asynchronous iterator over (pitch, roll) from interrupt driven gyro sampling:
+
+        async for pitch, roll in GyroStream():
+            ...
+
+    Waits on a ThreadSafeFlag set by the gyro's data ready handling instead of polling. Each
+    iteration integrates all samples that arrived in the meantime, so a slow consumer does not
+    lose samples as long as the ring buffer does not overflow (counted in gyro.ring.dropped).
+    '''
+    def __init__(self, gm=None, gyro=None, ring_size=64, odr=None):
+        from lab import gyro_tools
+        from lab.deltat import DeltaTUs
+        if gyro is None:
+            gyro = gyro_tools.get_gyro()
+        if gm is None:
+            gm = gyro_tools.GyroMadgwick(deltat=DeltaTUs(True))
+        if gyro.ring is None:
+            gyro.enable_irq(ring_size, odr)
+        self.gm = gm
+        self.ring = gyro.ring
+        self.flag = asyncio.ThreadSafeFlag()
+        gyro.flag = self.flag
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not len(self.ring):
+            await self.flag.wait()
+        self.gm.update_ring(self.ring)
+        return self.gm.pitch, self.gm.roll
+
+
+class Queue:
+    '''
+    Minimal FIFO queue for messages between coroutines (uasyncio has none built in).
+    put_nowait() drops the message and returns False if the queue is full.
+    '''
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.items = []
+        self.event = asyncio.Event()
+
+    def __len__(self):
+        return len(self.items)
+
+    def put_nowait(self, item):
+        if len(self.items) >= self.maxsize:
+            return False
+        self.items.append(item)
+        self.event.set()
+        return True
+
+    async def wait(self):
+        while not self.items:
+            self.event.clear()
+            await self.event.wait()
+
+    async def get(self):
+        await self.wait()
+        return self.items.pop(0)
+
+
+# Message types as in pyRTOS, user defined types start at 128
+QUIT = 0
+
+# Mailboxes of the running tasks, by name
+mailboxes = {}
+
+
+class Message:
+    __slots__ = ('type', 'source', 'target', 'message')
+
+    def __init__(self, type, source, target, message=None):
+        self.type = type
+        self.source = source
+        self.target = target
+        self.message = message
+
+
+def mailbox(name, maxsize=16):
+    '''
+    Creates and registers the mailbox of the task called name.
+    '''
+    box = Queue(maxsize)
+    mailboxes[name] = box
+    return box
+
+
+def send(msg):
+    '''
+    Delivers msg to the mailbox of msg.target. Like pyRTOS, messages to unknown tasks are silently dropped.
+    Returns True if the message was delivered.
+    '''
+    box = mailboxes.get(msg.target)
+    if box is None:
+        return False
+    return box.put_nowait(msg)
+
+
+def run(*coros):
+    '''
+    Runs the coroutines until all of them have finished (forever if one of them is display_refresh()).
+    '''
+    async def main():
+        await asyncio.gather(*coros)
+    asyncio.run(main())
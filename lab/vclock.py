@@ -0,0 +1,194 @@
+# Deterministic virtual time for running DeltaT, the sensor fusion and the
+# pyRTOS task helpers on a host (CPython or the unix port) without hardware.
+#
+# VirtualClock mimics the ticks functions of the MicroPython time module,
+# including the wrap around at 2**30, and only moves when advanced. It can be
+# handed to lab.deltat (clock=...) and lab.pyrtos_tools.set_clock().
+#
+# Simulation runs pyRTOS style task functions against the clock. Whenever no
+# task is ready, time jumps straight to the earliest wake-up requested with
+# Periodic or until_us(), so long runs take as long as the computation itself:
+#
+#   clock = VirtualClock()
+#   sim = Simulation(clock)
+#   sim.add_task(sample_task, name="sensor", priority=1)
+#   sim.run(3600 * 1000000)
+
+TICKS_MAX = (1 << 30) - 1
+TICKS_HALF = 1 << 29
+
+
+class VirtualClock:
+
+    def __init__(self, start_us=0):
+        self.now = start_us                 # Absolute time in μs, never wraps
+
+    def advance(self, us):
+        self.now += us
+
+    def advance_to(self, ticks):
+        # Moves forward to the ticks_us() value ticks (never backwards)
+        delta = self.ticks_diff(ticks, self.ticks_us())
+        if delta > 0:
+            self.now += delta
+
+    def ticks_us(self):
+        return self.now & TICKS_MAX
+
+    def ticks_ms(self):
+        return (self.now // 1000) & TICKS_MAX
+
+    def ticks_diff(self, end, start):
+        return ((end - start + TICKS_HALF) & TICKS_MAX) - TICKS_HALF
+
+    def ticks_add(self, ticks, delta):
+        return (ticks + delta) & TICKS_MAX
+
+    def timediff(self, end, start):
+        # timediff function for lab.deltat.DeltaT, in seconds
+        return self.ticks_diff(end, start) / 1000000
+
+
+class SimTask:
+    '''
+    Stand-in for pyRTOS.Task inside a Simulation. Messages are delivered by target name.
+    cost_us is the virtual CPU time charged for every iteration, to model load and provoke overruns.
+    '''
+
+    def __init__(self, sim, func, name, priority, cost_us):
+        self.sim = sim
+        self.name = name
+        self.priority = priority
+        self.cost_us = cost_us
+        self.mailbox = []
+        self.blocks = None
+        self.iterations = 0
+        self.thread = func(self)
+
+    def send(self, msg):
+        target = msg.target if isinstance(msg.target, str) else msg.target.name
+        for task in self.sim.tasks:
+            if task.name == target:
+                task.mailbox.append(msg)
+
+    def recv(self):
+        msgs = self.mailbox
+        self.mailbox = []
+        return msgs
+
+    def ready(self):
+        if not self.blocks:
+            return True
+        for condition in self.blocks:
+            if next(condition):
+                self.blocks = None
+                return True
+        return False
+
+    def wake_time(self):
+        # Earliest known wake-up of the blocking conditions, None if there is none
+        wake = None
+        for condition in self.blocks:
+            deadline = getattr(condition, 'deadline', None)
+            if deadline is not None and (wake is None or self.sim.clock.ticks_diff(deadline, wake) < 0):
+                wake = deadline
+        return wake
+
+
+class Simulation:
+    '''
+    Cooperative scheduler over a VirtualClock. Like pyRTOS it always runs the ready task with the
+    lowest priority value. Blocking conditions without a known deadline are polled every poll_us.
+    '''
+
+    def __init__(self, clock, poll_us=1000):
+        self.clock = clock
+        self.poll_us = poll_us
+        self.tasks = []
+
+    def add_task(self, func, name=None, priority=255, cost_us=0):
+        task = SimTask(self, func, name or func.__name__, priority, cost_us)
+        self.tasks.append(task)
+        self.tasks.sort(key=lambda t: t.priority)
+        return task
+
+    def run(self, duration_us):
+        clock = self.clock
+        end = clock.now + duration_us
+        tasks = self.tasks
+        while tasks and clock.now < end:
+            for task in tasks:
+                if task.ready():
+                    break
+            else:
+                task = None
+
+            if task is None:
+                # Nothing to do, jump to the next known wake-up
+                wake = None
+                for t in tasks:
+                    w = t.wake_time()
+                    if w is not None and (wake is None or clock.ticks_diff(w, wake) < 0):
+                        wake = w
+                if wake is None:
+                    clock.advance(self.poll_us)
+                else:
+                    clock.advance_to(wake)
+                    if clock.now > end:
+                        clock.now = end
+                continue
+
+            try:
+                task.blocks = next(task.thread)
+            except StopIteration:
+                tasks.remove(task)
+            task.iterations += 1
+            clock.advance(task.cost_us)
+
+
+def main(hours=1.0, gyro_hz=1000, ui_hz=25):
+    '''
+    Example and regression run: a gyro task integrating synthetic samples at gyro_hz and a UI task
+    reading pitch and roll at ui_hz for the given simulated time. Prints the result and the run time.
+    '''
+    import time
+    from math import sin
+
+    from lab import pyrtos_tools
+    from lab.deltat import DeltaTUs
+    from lab.fusion import GyroMadgwick
+
+    clock = VirtualClock()
+    pyrtos_tools.set_clock(clock)
+    gm = GyroMadgwick(deltat=DeltaTUs(clock=clock))
+    ui = [0, 0.0, 0.0]
+
+    @pyrtos_tools.periodic(1000000 // gyro_hz)
+    def gyro_task(self):
+        # Slow rotation around x and y, mdps
+        t = clock.now / 1000000
+        gm.update_mdps(20000 * sin(0.5 * t), 10000 * sin(0.3 * t), 0)
+
+    @pyrtos_tools.periodic(1000000 // ui_hz)
+    def ui_task(self):
+        ui[0] += 1
+        ui[1] = gm.pitch
+        ui[2] = gm.roll
+
+    sim = Simulation(clock)
+    sim.add_task(gyro_task, name="gyro", priority=1)
+    sim.add_task(ui_task, name="ui", priority=2)
+    start = time.time()
+    sim.run(int(hours * 3600 * 1000000))
+    elapsed = time.time() - start
+    pyrtos_tools.set_clock()
+
+    print(f'simulated {hours} h in {elapsed:.1f} s')
+    for task in sim.tasks:
+        timer = pyrtos_tools.periodic_timers[task.name]
+        print(f'{task.name}: iterations={task.iterations} overruns={timer.overruns} skipped={timer.skipped}')
+    print(f'ui updates={ui[0]} pitch={ui[1]:.3f} roll={ui[2]:.3f}')
+
+
+if __name__ == '__main__':
+    main()
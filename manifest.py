@@ -8,17 +8,30 @@ freeze("$(MPY_DIR)/lib/lv_bindings/lib", "lv_utils.py")
 freeze(".",
     (
         "lab/__init__.py",
+        "lab/bootprof.py",
         "lab/colors.py",
         "lab/deltat.py",
         "lab/device_tools.py",
         "lab/display_tools.py",
+        "lab/dma2d.py",
+        "lab/fusion.py",
+        "lab/fusion_native.py",
+        "lab/gyro_filters.py",
         "lab/gyro_tools.py",
+        "lab/gyro_trace.py",
+        "lab/logger.py",
         "lab/pyrtos_tools.py",
+        "lab/refresh.py",
+        "lab/telemetry.py",
+        "lab/touch.py",
+        "lab/uasyncio_tools.py",
         "lab/demos/__init__.py",
         "lab/demos/lvgl_hello_world.py",
         "lab/demos/lvgl_gyro.py",
         "lab/demos/pyrtos_hello_world.py",
         "lab/demos/pyrtos_sample.py",
+        "lab/demos/uasyncio_hello_world.py",
+        "lab/demos/uasyncio_sample.py",
     ),
 )
 
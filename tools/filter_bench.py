@@ -0,0 +1,166 @@
+'''
+Cost versus accuracy benchmark of the orientation filters in lab.fusion.
+
+Every filter runs over the same reference traces with a known true orientation: synthetic motion
+scenarios with gyro noise and bias and, optionally, an accelerometer. Recorded gyro traces
+(lab.gyro_trace) can be added; their reference is plain gyro integration (tools.gyro_replay), so the
+error there shows how far a filter departs from it rather than the truth. Reported are the time per
+update and the RMS, maximum and final pitch/roll error in degrees:
+
+    python -m tools.filter_bench
+    python -m tools.filter_bench --filters madgwick complementary --seconds 120 --bias 500
+    python -m tools.filter_bench --trace trace1.gtr
+
+The times are host CPU times; the ranking carries over to the board, the absolute numbers do not.
+Run from the repository root.
+'''
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lab.deltat import FixedDeltaT
+from lab.fusion import FILTERS
+
+# Angular rate in dps of the motion scenarios as a function of time
+SCENARIOS = {
+    'static': lambda t: (0.0, 0.0, 0.0),
+    'tilt': lambda t: (20 * math.sin(0.5 * t), 10 * math.sin(0.3 * t), 0.0),
+    'turns': lambda t: (60 * math.sin(1.3 * t), 40 * math.cos(0.7 * t), 90 * math.sin(0.2 * t)),
+}
+
+
+def quat_step(q, wx, wy, wz, dt):
+    # Exact rotation of q by the body rate (rad/s) over dt
+    angle = math.sqrt(wx * wx + wy * wy + wz * wz) * dt
+    if angle < 1e-12:
+        return q
+    s = math.sin(angle / 2) / (angle / dt)
+    dw, dx, dy, dz = math.cos(angle / 2), wx * s, wy * s, wz * s
+    w, x, y, z = q
+    return (w * dw - x * dx - y * dy - z * dz,
+            w * dx + x * dw + y * dz - z * dy,
+            w * dy - x * dz + y * dw + z * dx,
+            w * dz + x * dy - y * dx + z * dw)
+
+
+def euler(q):
+    # Pitch and roll in degrees, as GyroMadgwick
+    w, x, y, z = q
+    pitch = math.degrees(-math.asin(max(-1.0, min(1.0, 2 * (x * z - w * y)))))
+    roll = math.degrees(math.atan2(2 * (w * x + y * z), w * w - x * x - y * y + z * z))
+    return pitch, roll
+
+
+def synthesize(rates, seconds, odr, bias_mdps=0.0, gyro_noise_mdps=100.0, accel_noise_g=0.02, seed=0):
+    '''
+    Returns the samples (gx, gy, gz in mdps, ax, ay, az in g) and the true pitch and roll after each.
+    '''
+    rng = random.Random(seed)
+    dt = 1 / odr
+    q = (1.0, 0.0, 0.0, 0.0)
+    samples = []
+    truth = []
+    for i in range(int(seconds * odr)):
+        t = i * dt
+        rx, ry, rz = rates(t)
+        q = quat_step(q, math.radians(rx), math.radians(ry), math.radians(rz), dt)
+        w, x, y, z = q
+        # Gravity in body coordinates, z up when level
+        ax, ay, az = 2 * (x * z - w * y), 2 * (w * x + y * z), w * w - x * x - y * y + z * z
+        samples.append((1000 * rx + bias_mdps + rng.gauss(0, gyro_noise_mdps),
+                        1000 * ry + bias_mdps + rng.gauss(0, gyro_noise_mdps),
+                        1000 * rz + bias_mdps + rng.gauss(0, gyro_noise_mdps),
+                        ax + rng.gauss(0, accel_noise_g),
+                        ay + rng.gauss(0, accel_noise_g),
+                        az + rng.gauss(0, accel_noise_g)))
+        truth.append(euler(q))
+    return samples, truth
+
+
+def load_trace(path):
+    '''
+    Returns the samples of a recorded gyro trace (no accelerometer), its output data rate and the
+    pitch and roll of plain gyro integration as reference.
+    '''
+    from tools import gyro_replay
+
+    odr, mdps_per_lsb, ts, xyz = gyro_replay.load_trace(path)
+    pitch, roll = gyro_replay.euler(gyro_replay.fuse(ts, xyz, mdps_per_lsb))
+    samples = [(float(x) * mdps_per_lsb, float(y) * mdps_per_lsb, float(z) * mdps_per_lsb, 0.0, 0.0, 0.0)
+               for x, y, z in xyz]
+    return samples, odr or 760, list(zip(pitch.tolist(), roll.tolist()))
+
+
+def bench(cls, samples, truth, odr, accel=True, **params):
+    '''
+    Runs the filter class cls over samples and returns μs per update and the RMS, maximum and final
+    pitch/roll error in degrees against truth.
+    '''
+    f = cls(deltat=FixedDeltaT(1000000 / odr), **params)
+    imu = accel and hasattr(f, 'update_imu')
+    start = time.perf_counter()
+    if imu:
+        for gx, gy, gz, ax, ay, az in samples:
+            f.update_imu(gx, gy, gz, ax, ay, az)
+    else:
+        for gx, gy, gz, _, _, _ in samples:
+            f.update_mdps(gx, gy, gz)
+    elapsed = time.perf_counter() - start
+    # Second pass for the errors, so reading the angles is not part of the timing
+    f = cls(deltat=FixedDeltaT(1000000 / odr), **params)
+    sq = 0.0
+    worst = 0.0
+    err = 0.0
+    for (gx, gy, gz, ax, ay, az), (pitch, roll) in zip(samples, truth):
+        if imu:
+            f.update_imu(gx, gy, gz, ax, ay, az)
+        else:
+            f.update_mdps(gx, gy, gz)
+        dr = (f.roll - roll + 180) % 360 - 180
+        err = max(abs(f.pitch - pitch), abs(dr))
+        sq += (f.pitch - pitch) ** 2 + dr ** 2
+        worst = max(worst, err)
+    n = max(len(samples), 1)
+    return {
+        'us_per_update': elapsed * 1e6 / n,
+        'rms_deg': math.sqrt(sq / (2 * n)),
+        'max_deg': worst,
+        'final_deg': err,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the orientation filters of lab.fusion')
+    parser.add_argument('--filters', nargs='+', default=list(FILTERS), choices=list(FILTERS))
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--trace', nargs='*', default=[], help='recorded gyro traces')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--odr', type=int, default=190)
+    parser.add_argument('--bias', type=float, default=200.0, help='gyro bias on all axes, mdps')
+    parser.add_argument('--no-accel', action='store_true', help='feed the gyro only')
+    args = parser.parse_args()
+
+    traces = []
+    for name in args.scenarios:
+        samples, truth = synthesize(SCENARIOS[name], args.seconds, args.odr, args.bias)
+        traces.append((name, samples, truth, args.odr))
+    for path in args.trace:
+        samples, odr, truth = load_trace(path)
+        traces.append((path, samples, truth, odr))
+
+    print('trace,filter,us_per_update,rms_deg,max_deg,final_deg')
+    for name, samples, truth, odr in traces:
+        for filter_name in args.filters:
+            r = bench(FILTERS[filter_name], samples, truth, odr, not args.no_accel)
+            print(f"{name},{filter_name},{r['us_per_update']:.2f},{r['rms_deg']:.3f},"
+                  f"{r['max_deg']:.3f},{r['final_deg']:.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,178 @@
+'''
+Host side replay of gyro traces recorded with lab.gyro_trace.
+
+The gyro-only fusion of lab.fusion multiplies the quaternion by (1, k/2 * rate) and normalises after
+every sample. As normalisation is a scalar factor, the whole trace is a chain of quaternion products,
+which is evaluated here with NumPy as a parallel prefix scan in log2(n) vectorised steps. Sweeps over
+many traces and parameter sets run in a process pool.
+
+    python -m tools.gyro_replay trace1.gtr trace2.gtr --bias 0 -50 50 --scale 0.98 1 1.02
+    python -m tools.gyro_replay trace1.gtr --check          # compare with lab.fusion.GyroMadgwick
+    python -m tools.gyro_replay --synth synth.gtr --seconds 60
+
+Run from the repository root. Requires NumPy.
+'''
+
+import argparse
+import itertools
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lab import gyro_trace
+
+MDPS_TO_RAD = math.pi / 180000
+TICKS_PERIOD = 1 << 30          # MicroPython ticks_us() wraps at 2**30
+FIRST_DT = 0.0001               # Notional first time step, as lab.deltat
+
+
+def load_trace(path):
+    '''
+    Returns odr, mdps_per_lsb, timestamps (uint32) and samples (n x 3 int16) of a trace file.
+    '''
+    with open(path, 'rb') as f:
+        odr, mdps_per_lsb = gyro_trace.read_header(f)
+        dtype = np.dtype([('ts', '<u4'), ('xyz', '<i2', 3)])
+        records = np.frombuffer(f.read(), dtype=dtype)
+    return odr, mdps_per_lsb, records['ts'], records['xyz']
+
+
+def quat_mul(a, b):
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack((
+        aw * bw - ax * bx - ay * by - az * bz,
+        aw * bx + ax * bw + ay * bz - az * by,
+        aw * by - ax * bz + ay * bw + az * bx,
+        aw * bz + ax * by - ay * bx + az * bw,
+    ), axis=-1)
+
+
+def fuse(ts, xyz, mdps_per_lsb, bias_mdps=0.0, scale=1.0):
+    '''
+    Returns the quaternion after every sample (n x 4) for one trace, with bias_mdps subtracted from and
+    scale applied to all axes.
+    '''
+    n = len(ts)
+    dt = np.empty(n)
+    dt[0] = FIRST_DT
+    dt[1:] = (np.diff(ts.astype(np.int64)) % TICKS_PERIOD) * 1e-6
+    rates = xyz.astype(np.float64) * (mdps_per_lsb * scale) - bias_mdps
+    p = np.empty((n, 4))
+    p[:, 0] = 1.0
+    p[:, 1:] = rates * (0.5 * MDPS_TO_RAD * dt)[:, None]
+
+    # Inclusive prefix product p[0] * ... * p[i], normalised at every step to stay in range
+    shift = 1
+    while shift < n:
+        p[shift:] = quat_mul(p[:-shift], p[shift:])
+        p[shift:] /= np.linalg.norm(p[shift:], axis=1)[:, None]
+        shift *= 2
+    return p / np.linalg.norm(p, axis=1)[:, None]
+
+
+def euler(q):
+    '''
+    Returns pitch and roll in degrees for quaternions q (n x 4), as GyroMadgwick.
+    '''
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+    pitch = np.degrees(-np.arcsin(np.clip(2.0 * (x * z - w * y), -1.0, 1.0)))
+    roll = np.degrees(np.arctan2(2.0 * (w * x + y * z), w * w - x * x - y * y + z * z))
+    return pitch, roll
+
+
+def replay(job):
+    path, bias_mdps, scale = job
+    odr, mdps_per_lsb, ts, xyz = load_trace(path)
+    pitch, roll = euler(fuse(ts, xyz, mdps_per_lsb, bias_mdps, scale))
+    duration = (int(ts[-1]) - int(ts[0])) % TICKS_PERIOD * 1e-6 if len(ts) > 1 else 0.0
+    return {
+        'path': path,
+        'bias_mdps': bias_mdps,
+        'scale': scale,
+        'samples': len(ts),
+        'seconds': duration,
+        'pitch': float(pitch[-1]),
+        'roll': float(roll[-1]),
+        'max_abs_pitch': float(np.abs(pitch).max()),
+        'max_abs_roll': float(np.abs(roll).max()),
+    }
+
+
+def sweep(paths, biases=(0.0,), scales=(1.0,), workers=None):
+    '''
+    Replays every trace with every bias and scale combination in a process pool.
+    '''
+    jobs = list(itertools.product(paths, biases, scales))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(replay, jobs, chunksize=max(1, len(jobs) // (4 * (workers or os.cpu_count() or 1)))))
+
+
+def check(path):
+    '''
+    Replays path through lab.fusion.GyroMadgwick and returns the largest pitch/roll difference in degrees
+    against the NumPy result.
+    '''
+    from lab.deltat import DeltaTUs
+    from lab.fusion import GyroMadgwick
+    from lab.vclock import VirtualClock
+
+    odr, mdps_per_lsb, ts, xyz = load_trace(path)
+    pitch, roll = euler(fuse(ts, xyz, mdps_per_lsb))
+    gm = GyroMadgwick(deltat=DeltaTUs(True, clock=VirtualClock()))
+    err = 0.0
+    for i in range(len(ts)):
+        x, y, z = xyz[i]
+        gm.update_mdps(int(x) * mdps_per_lsb, int(y) * mdps_per_lsb, int(z) * mdps_per_lsb, int(ts[i]) & (TICKS_PERIOD - 1))
+        err = max(err, abs(gm.pitch - pitch[i]), abs(gm.roll - roll[i]))
+    return err
+
+
+def synthesize(path, seconds=60, odr=760, mdps_per_lsb=17.5, seed=0):
+    '''
+    Writes a synthetic trace: slow oscillations around x and y plus white noise.
+    '''
+    rng = np.random.default_rng(seed)
+    n = int(seconds * odr)
+    t = np.arange(n) / odr
+    rates = np.stack((20000 * np.sin(0.5 * t), 10000 * np.sin(0.3 * t), np.zeros(n)), axis=1)
+    counts = np.clip(np.round(rates / mdps_per_lsb + rng.normal(0, 2, (n, 3))), -32768, 32767)
+    ts = np.round(t * 1e6).astype(np.int64) % TICKS_PERIOD
+    with open(path, 'wb') as f:
+        writer = gyro_trace.TraceWriter(f, mdps_per_lsb, odr, buffer_records=1024)
+        for i in range(n):
+            writer.write(int(ts[i]), int(counts[i, 0]), int(counts[i, 1]), int(counts[i, 2]))
+        writer.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay gyro traces through the sensor fusion')
+    parser.add_argument('traces', nargs='*')
+    parser.add_argument('--bias', type=float, nargs='+', default=[0.0], help='bias to subtract, mdps')
+    parser.add_argument('--scale', type=float, nargs='+', default=[1.0], help='sensitivity scale factor')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--check', action='store_true', help='compare with lab.fusion.GyroMadgwick')
+    parser.add_argument('--synth', metavar='PATH', help='write a synthetic trace to PATH')
+    parser.add_argument('--seconds', type=float, default=60)
+    args = parser.parse_args()
+
+    if args.synth:
+        synthesize(args.synth, args.seconds)
+    if args.check:
+        for path in args.traces:
+            print(f'{path}: max difference to GyroMadgwick {check(path):.6f} deg')
+        return
+    if args.traces:
+        print('path,bias_mdps,scale,samples,seconds,pitch,roll,max_abs_pitch,max_abs_roll')
+        for r in sweep(args.traces, args.bias, args.scale, args.workers):
+            print(f"{r['path']},{r['bias_mdps']},{r['scale']},{r['samples']},{r['seconds']:.3f},"
+                  f"{r['pitch']:.4f},{r['roll']:.4f},{r['max_abs_pitch']:.4f},{r['max_abs_roll']:.4f}")
+
+
+if __name__ == '__main__':
+    main()
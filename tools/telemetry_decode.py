@@ -0,0 +1,162 @@
+'''
+Host side decoder for the binary telemetry of lab.telemetry.
+
+Reads frames from a serial device (with pyserial if installed, otherwise as a plain file, which is
+enough for a pty or a tty already configured with stty), prints them as CSV or plots pitch and roll
+live with matplotlib:
+
+    python -m tools.telemetry_decode /dev/ttyACM0
+    python -m tools.telemetry_decode /dev/ttyACM0 --plot
+    python -m tools.telemetry_decode --demo --plot      # synthetic board on a pty
+
+Run from the repository root.
+'''
+
+import argparse
+import collections
+import math
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lab import telemetry
+
+NAMES = {
+    telemetry.T_ATTITUDE: 'attitude',
+    telemetry.T_QUATERNION: 'quaternion',
+    telemetry.T_GYRO: 'gyro',
+    telemetry.T_TASK: 'task',
+}
+
+
+def open_port(path, baud=115200):
+    '''
+    Returns a read(n) function for the serial device or pty path.
+    '''
+    try:
+        import serial
+    except ImportError:
+        fd = os.open(path, os.O_RDONLY | os.O_NOCTTY)
+        return lambda n: os.read(fd, n)
+    # Block until data arrives, so idle gaps do not end frames(); a closed port raises SerialException (an OSError)
+    port = serial.Serial(path, baud, timeout=None)
+    return lambda n: port.read(max(1, min(n, port.in_waiting)))
+
+
+def frames(read, decoder=None, chunk=4096):
+    '''
+    Yields (type, seq, values) for the frames decoded from read() until it returns no data (end of file)
+    or raises OSError (the device is gone).
+    '''
+    decoder = decoder or telemetry.Decoder()
+    while True:
+        try:
+            data = read(chunk)
+        except OSError:
+            # A pty reports EIO once the other end is closed
+            return
+        if not data:
+            return
+        yield from decoder.feed(data)
+
+
+def fake_board(fd, seconds=10.0, rate=200):
+    '''
+    Writes synthetic telemetry at rate frames per second to the file descriptor fd, as the board would.
+    '''
+    class Stream:
+        def write(self, data):
+            os.write(fd, data)
+
+    tm = telemetry.Telemetry(Stream(), batch_bytes=256)
+    start = time.monotonic()
+    n = 0
+    while n < seconds * rate:
+        t = n / rate
+        ts = int(t * 1e6) & ((1 << 30) - 1)
+        pitch, roll = 30 * math.sin(0.5 * t), 20 * math.sin(0.3 * t)
+        tm.attitude(ts, pitch, roll)
+        tm.gyro(ts, 15000 * math.cos(0.5 * t), 6000 * math.cos(0.3 * t), 0)
+        n += 1
+        if n % (rate // 10) == 0:
+            tm.flush()
+            time.sleep(max(0.0, start + t - time.monotonic()))
+    tm.flush()
+    os.close(fd)
+
+
+def print_csv(source, decoder):
+    for ftype, seq, values in source:
+        if ftype == telemetry.T_TASK:
+            values = (values[0].rstrip(b'\0').decode(),) + values[1:]
+        print(NAMES[ftype], seq, *values, sep=',')
+    print(f'# lost={decoder.lost} crc_errors={decoder.crc_errors} skipped={decoder.skipped}', file=sys.stderr)
+
+
+def plot(source, decoder, window=1000):
+    import matplotlib.pyplot as plt
+    from matplotlib.animation import FuncAnimation
+
+    pitch = collections.deque(maxlen=window)
+    roll = collections.deque(maxlen=window)
+
+    def reader():
+        for ftype, seq, values in source:
+            if ftype == telemetry.T_ATTITUDE:
+                pitch.append(values[1])
+                roll.append(values[2])
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    fig, ax = plt.subplots()
+    pitch_line, = ax.plot([], [], label='pitch')
+    roll_line, = ax.plot([], [], label='roll')
+    ax.set_xlim(0, window)
+    ax.set_ylim(-180, 180)
+    ax.set_ylabel('degrees')
+    ax.legend(loc='upper right')
+
+    def update(_):
+        pitch_line.set_data(range(len(pitch)), list(pitch))
+        roll_line.set_data(range(len(roll)), list(roll))
+        ax.set_title(f'lost={decoder.lost} crc_errors={decoder.crc_errors}')
+        return pitch_line, roll_line
+
+    _ = FuncAnimation(fig, update, interval=50, cache_frame_data=False)
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Decode lab.telemetry frames')
+    parser.add_argument('port', nargs='?', help='serial device or pty')
+    parser.add_argument('--baud', type=int, default=115200)
+    parser.add_argument('--plot', action='store_true', help='plot pitch and roll (requires matplotlib)')
+    parser.add_argument('--demo', action='store_true', help='decode a synthetic board on a pty')
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    if args.demo:
+        import tty
+        board, host = os.openpty()
+        # Raw mode, so the line discipline does not translate the binary data
+        tty.setraw(board)
+        threading.Thread(target=fake_board, args=(board, args.seconds), daemon=True).start()
+        read = lambda n: os.read(host, n)
+    elif args.port:
+        read = open_port(args.port, args.baud)
+    else:
+        parser.error('a port or --demo is required')
+
+    decoder = telemetry.Decoder()
+    source = frames(read, decoder)
+    if args.plot:
+        plot(source, decoder)
+    else:
+        print_csv(source, decoder)
+
+
+if __name__ == '__main__':
+    main()